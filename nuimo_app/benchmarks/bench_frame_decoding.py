@@ -0,0 +1,116 @@
+"""
+Throughput benchmark for decoding HA websocket frames in HAListener.
+
+Replays a stream of `state_changed` event frames through
+`HAListener.process_message` with every installed JSON codec and
+compares it to decoding every frame with `json.loads`.
+
+Usage: python -m benchmarks.bench_frame_decoding [recorded_frames.txt]
+
+A recorded stream is a text file with one raw websocket frame per line,
+without a recording a stream resembling a large HA installation is
+generated.
+
+"""
+import json
+import random
+import sys
+import time
+
+from unittest.mock import MagicMock
+
+from senic.nuimo_app.codec import CODECS
+from senic.nuimo_app.hass import HAListener
+
+
+NUM_ENTITIES = 2000
+NUM_LISTENED_ENTITIES = 20
+NUM_FRAMES = 50000
+SUBSCRIPTION_ID = 2
+
+
+def make_state(entity_id):
+    return {
+        "entity_id": entity_id,
+        "state": random.choice(["on", "off"]),
+        "attributes": {
+            "friendly_name": entity_id.split(".")[1].replace("_", " ").title(),
+            "brightness": random.randint(0, 255),
+            "rgb_color": [random.randint(0, 255) for _ in range(3)],
+            "xy_color": [random.random(), random.random()],
+            "supported_features": 61,
+        },
+        "last_changed": "2017-03-01T12:00:00.000000+00:00",
+        "last_updated": "2017-03-01T12:00:00.000000+00:00",
+    }
+
+
+def generate_frames():
+    entity_ids = ["light.entity_{}".format(i) for i in range(NUM_ENTITIES)]
+    frames = []
+    for _ in range(NUM_FRAMES):
+        entity_id = random.choice(entity_ids)
+        frames.append(json.dumps({
+            "id": SUBSCRIPTION_ID,
+            "type": "event",
+            "event": {
+                "event_type": "state_changed",
+                "data": {
+                    "entity_id": entity_id,
+                    "old_state": make_state(entity_id),
+                    "new_state": make_state(entity_id),
+                },
+                "origin": "LOCAL",
+                "time_fired": "2017-03-01T12:00:00.000000+00:00",
+            },
+        }))
+
+    return frames, entity_ids[:NUM_LISTENED_ENTITIES]
+
+
+def read_frames(path):
+    with open(path) as f:
+        frames = [x.strip() for x in f if x.strip()]
+
+    entity_ids = set()
+    for frame in frames:
+        message = json.loads(frame)
+        if message.get("type") == "event" and message["event"].get("event_type") == "state_changed":
+            entity_ids.add(message["event"]["data"]["entity_id"])
+
+    return frames, sorted(entity_ids)[:NUM_LISTENED_ENTITIES]
+
+
+def measure(process, frames):
+    start = time.perf_counter()
+    for frame in frames:
+        process(frame)
+    return len(frames) / (time.perf_counter() - start)
+
+
+def main():
+    random.seed(0)
+    if len(sys.argv) > 1:
+        frames, listened_entity_ids = read_frames(sys.argv[1])
+    else:
+        frames, listened_entity_ids = generate_frames()
+
+    size = sum(len(x) for x in frames)
+    print("{} frames, {:.1f} MB, {} listened entities".format(len(frames), size / 1e6, len(listened_entity_ids)))
+    print("json.loads all frames: {:>10.0f} frames/s".format(measure(json.loads, frames)))
+
+    for name, factory in CODECS:
+        try:
+            factory()
+        except ImportError:
+            continue
+
+        listener = HAListener("ws://localhost:8123", MagicMock(), codec=name)
+        listener.event_subscription_id = SUBSCRIPTION_ID
+        listener.register_state_listener(tuple(listened_entity_ids), lambda payload: None)
+
+        print("process_message {:<6}: {:>10.0f} frames/s".format(name, measure(listener.process_message, frames)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Micro-benchmark for HAListener state_changed dispatch.
+
+Compares the former scan over all registered entity tuples with the
+entity indexed dispatch for a large number of entities of which only a
+few are known to the registered listeners.
+
+Usage: python -m benchmarks.bench_state_dispatch
+
+"""
+import timeit
+
+from unittest.mock import MagicMock
+
+from senic.nuimo_app.hass import HAListener
+
+
+NUM_ENTITIES = 5000
+NUM_LISTENERS = 50
+ENTITIES_PER_LISTENER = 5
+NUM_EVENTS = 100000
+
+
+def noop(payload):
+    pass
+
+
+def scan_dispatch(listener, payload):
+    entity_id = payload["data"]["entity_id"]
+    listeners_to_notify = [x for x in listener.state_listeners if entity_id in x]
+    for entity_ids in listeners_to_notify:
+        for callback in listener.state_listeners[entity_ids]:
+            callback(payload)
+
+
+def main():
+    listener = HAListener("ws://localhost:8123", MagicMock())
+
+    entity_ids = ["light.entity_{}".format(i) for i in range(NUM_ENTITIES)]
+    for i in range(NUM_LISTENERS):
+        start = i * ENTITIES_PER_LISTENER
+        listener.register_state_listener(tuple(entity_ids[start:start + ENTITIES_PER_LISTENER]), noop)
+
+    payloads = [{"data": {"entity_id": x}} for x in entity_ids]
+
+    def run(dispatch):
+        for i in range(NUM_EVENTS):
+            dispatch(payloads[i % NUM_ENTITIES])
+
+    scan = min(timeit.repeat(lambda: run(lambda p: scan_dispatch(listener, p)), number=1, repeat=3))
+    indexed = min(timeit.repeat(lambda: run(listener.process_event), number=1, repeat=3))
+
+    print("{} entities, {} listeners, {} events".format(NUM_ENTITIES, NUM_LISTENERS, NUM_EVENTS))
+    print("scan:    {:.3f}s ({:.2f} us/event)".format(scan, scan / NUM_EVENTS * 1e6))
+    print("indexed: {:.3f}s ({:.2f} us/event)".format(indexed, indexed / NUM_EVENTS * 1e6))
+    print("speedup: {:.1f}x".format(scan / indexed))
+
+
+if __name__ == "__main__":
+    main()
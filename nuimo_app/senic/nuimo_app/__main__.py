@@ -1,5 +1,6 @@
 import configparser
 import logging
+import signal
 import sys
 
 from nuimo import ControllerManager
@@ -37,17 +38,31 @@ def main(config_file_path=DEFAULT_CONFIG_FILE_PATH):
     ha_api = HAListener("ws://{}".format(ha_url))
     ha_api.start()
 
-    nuimo_app = None
-    controller_mac_address = config.get("controller_mac_address")
-    if controller_mac_address:
-        ble_adapter_name = config.get("ble_adapter_name", DEFAULT_BLE_ADAPTER_NAME)
-        nuimo_app = NuimoApp(controller_mac_address, ha_api, ble_adapter_name)
-
-    for cid in component_config.sections():
-        cfg = component_config[cid]
-        component_class = getattr(components, cfg["component"])
-        entities = split_entities(cfg["entities"])
-        nuimo_app.register_component(component_class(cfg["name"], entities))
+    # all controllers share the HA connection and its state mirror
+    nuimo_apps = {}
+    ble_adapter_name = config.get("ble_adapter_name", DEFAULT_BLE_ADAPTER_NAME)
+    for mac_address, cids in read_controllers(config, component_config).items():
+        nuimo_app = nuimo_apps[mac_address] = NuimoApp(mac_address, ha_api, ble_adapter_name)
+
+        # every controller gets its own component instances
+        for cid in cids:
+            cfg = component_config[cid]
+            component_class = getattr(components, cfg["component"])
+            entities = split_entities(cfg["entities"])
+            optimistic = cfg.getboolean("optimistic", False)
+            nuimo_app.register_component(
+                component_class(cfg["name"], entities, optimistic), read_gesture_overrides(cfg))
+
+    def log_stats(signum, frame):
+        logger.warning(ha_api.format_stats())
+        for mac_address, nuimo_app in nuimo_apps.items():
+            logger.warning("Gesture latencies of %s in ms:\n%s", mac_address, nuimo_app.tracer.format())
+            logger.warning("Skipped redundant service calls of %s: %s", mac_address,
+                           dict(nuimo_app.service_call_filter.skipped))
+            logger.warning("Timed out actions of %s: %s", mac_address, dict(nuimo_app.actions.timeouts))
+
+    # dump HA request statistics and gesture latencies on demand
+    signal.signal(signal.SIGUSR1, log_stats)
 
     try:
         manager.run()
@@ -55,7 +70,7 @@ def main(config_file_path=DEFAULT_CONFIG_FILE_PATH):
         logger.debug("Stopping...")
         manager.stop()
         ha_api.stop()
-        if nuimo_app:
+        for nuimo_app in nuimo_apps.values():
             nuimo_app.quit()
 
 
@@ -65,9 +80,49 @@ def read_config(config_file_path):
     return config["DEFAULT"], config
 
 
+def read_controllers(config, component_config):
+    """
+    Returns a dict of controller MAC address: [component section, ...].
+
+    Components are added to all controllers in `controller_mac_address`
+    unless their `controllers` key limits them to some.
+
+    """
+    mac_addresses = split_list(config.get("controller_mac_address", ""))
+    controllers = {x: [] for x in mac_addresses}
+
+    for cid in component_config.sections():
+        for mac_address in split_list(component_config[cid].get("controllers", "")) or mac_addresses:
+            if mac_address not in controllers:
+                logger.warning("Unknown controller %s for component %s", mac_address, cid)
+                continue
+
+            controllers[mac_address].append(cid)
+
+    return controllers
+
+
+def read_gesture_overrides(cfg):
+    """
+    Returns gesture name: handler name for all `gesture_<name>` keys,
+    e.g. `gesture_longtouch_top = button_press`.
+
+    """
+    prefix = "gesture_"
+    return {k[len(prefix):].upper(): v.strip() for k, v in cfg.items() if k.startswith(prefix)}
+
+
 def split_entities(s):
     return [x.strip() for x in s.split(",")]
 
 
+def split_list(s):
+    """
+    Splits a comma separated list, leaving out empty items.
+
+    """
+    return [x.strip() for x in s.split(",") if x.strip()]
+
+
 if __name__ == "__main__":
     main()
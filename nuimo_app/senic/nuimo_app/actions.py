@@ -1,3 +1,31 @@
+import heapq
+
+from collections import Counter
+from threading import Lock
+from time import monotonic
+
+from .hass import RELATIVE_SERVICE_ARGS
+
+
+DEFAULT_ACTION_TIMEOUT = 5  # seconds
+
+# domains whose services take a list of entity ids
+BATCH_DOMAINS = frozenset(["light", "media_player", "switch"])
+
+# (domain, service) of services that change something again every time
+# they are called
+NON_IDEMPOTENT_SERVICES = frozenset([
+    ("light", "toggle"),
+    ("media_player", "media_next_track"),
+    ("media_player", "media_play_pause"),
+    ("media_player", "media_previous_track"),
+    ("media_player", "toggle"),
+    ("media_player", "volume_down"),
+    ("media_player", "volume_up"),
+    ("switch", "toggle"),
+])
+
+
 class Action:
     def __init__(self, domain, service, entity_ids, led_matrix_config, **kw):
         self.domain = domain
@@ -5,9 +33,25 @@ class Action:
         self.entity_ids = entity_ids
         self.led_matrix_config = led_matrix_config
         self.extra_args = kw
+        # service data that differs by entity, entity_id: {key: value}
+        self.entity_args = {}
 
         self.service_call_results = {x: None for x in self.entity_ids}  # entity_id: Bool/None
 
+        # call the service once for all entities
+        self.batched = domain in BATCH_DOMAINS and len(entity_ids) > 1
+
+        # show `led_matrix_config` before HA confirmed the action
+        self.optimistic = False
+
+        # set when a newer action was started for any of the entities
+        self.superseded = False
+        # set when the action didn't complete before its deadline
+        self.timed_out = False
+
+        # trace of the gesture that led to the action
+        self.trace = None
+
     def is_complete(self):
         """Returns True if action was executed for all entities."""
         return all(x is not None for x in self.service_call_results.values())
@@ -18,3 +62,118 @@ class Action:
 
     def entity_updated(self, entity_id, success):
         self.service_call_results[entity_id] = success
+
+    def service_calls(self, entity_ids=None):
+        """
+        Returns a list of (entity_ids, service data) for the service
+        calls that apply the action to `entity_ids`, all entities by
+        default.
+
+        Batched actions make one call for all entities with the same
+        `entity_args`, whose values have to be hashable for that.
+
+        """
+        if entity_ids is None:
+            entity_ids = self.entity_ids
+
+        if not self.batched:
+            return [((x,), self.service_data((x,))) for x in entity_ids]
+
+        groups = {}  # entity args: [entity_id, ...]
+        for entity_id in entity_ids:
+            key = tuple(sorted(self.entity_args.get(entity_id, {}).items()))
+            groups.setdefault(key, []).append(entity_id)
+
+        return [(tuple(x), self.service_data(x)) for x in groups.values()]
+
+    def is_idempotent(self, data):
+        """
+        Returns True if calling the service with `data` again for an
+        entity it was applied to doesn't change anything, e.g. to retry
+        a failed batched call by entity.
+
+        """
+        return ((self.domain, self.service) not in NON_IDEMPOTENT_SERVICES and
+                not any(x in data for x in RELATIVE_SERVICE_ARGS))
+
+    def service_data(self, entity_ids):
+        """
+        Returns the service data for `entity_ids`, which have the same
+        `entity_args`.
+
+        """
+        data = {"entity_id": entity_ids[0] if len(entity_ids) == 1 else list(entity_ids)}
+        data.update(self.extra_args)
+        data.update(self.entity_args.get(entity_ids[0], {}))
+        return data
+
+
+class ActionTracker:
+    """
+    Keeps track of actions in flight by entity.
+
+    Actions for different entities are independent, starting an action
+    for an entity that already has one in flight supersedes the older
+    action. Actions that aren't finished before their deadline, kept in
+    a heap, are returned by `expire`.
+
+    """
+    def __init__(self, timeout=DEFAULT_ACTION_TIMEOUT):
+        self.timeout = timeout
+
+        self.actions = {}  # entity_id: action
+        self.deadlines = []  # heap of (deadline, sequence nr, action)
+        self.sequence_nr = 0
+        self.lock = Lock()
+
+        self.timeouts = Counter()  # "domain.service": nr of timed out actions
+
+    def start(self, action):
+        with self.lock:
+            for entity_id in action.entity_ids:
+                previous_action = self.actions.get(entity_id)
+                if previous_action and previous_action is not action:
+                    previous_action.superseded = True
+                self.actions[entity_id] = action
+
+            self.sequence_nr += 1
+            heapq.heappush(self.deadlines, (monotonic() + self.timeout, self.sequence_nr, action))
+
+    def finish(self, action):
+        with self.lock:
+            for entity_id in action.entity_ids:
+                if self.actions.get(entity_id) is action:
+                    del self.actions[entity_id]
+
+    def in_flight(self, entity_ids):
+        """
+        Returns the actions in flight for any of `entity_ids`.
+
+        """
+        with self.lock:
+            return {self.actions[x] for x in entity_ids if x in self.actions}
+
+    def expire(self, now=None):
+        """
+        Removes and returns actions that are still in flight after their
+        deadline and marks them as timed out.
+
+        """
+        now = now or monotonic()
+        expired = []
+
+        with self.lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                _, _, action = heapq.heappop(self.deadlines)
+                if action.is_complete():
+                    continue
+
+                action.timed_out = True
+                self.timeouts["{}.{}".format(action.domain, action.service)] += 1
+                expired.append(action)
+
+                for entity_id in action.entity_ids:
+                    if self.actions.get(entity_id) is action:
+                        del self.actions[entity_id]
+
+        return expired
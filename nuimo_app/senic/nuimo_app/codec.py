@@ -0,0 +1,155 @@
+import json
+import logging
+import re
+
+from collections import namedtuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class JSONCodec:
+    def __init__(self, name, loads, dumps):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+
+def _orjson_codec():
+    import orjson
+    return JSONCodec("orjson", orjson.loads, lambda obj: orjson.dumps(obj).decode())
+
+
+def _ujson_codec():
+    import ujson
+    return JSONCodec("ujson", ujson.loads, ujson.dumps)
+
+
+def _json_codec():
+    return JSONCodec("json", json.loads, json.dumps)
+
+
+# faster codecs first, `json` is always available
+CODECS = (
+    ("orjson", _orjson_codec),
+    ("ujson", _ujson_codec),
+    ("json", _json_codec),
+)
+
+
+def get_codec(name=None):
+    """
+    Returns the JSON codec called `name` or the fastest installed one.
+
+    """
+    for codec_name, factory in CODECS:
+        if name and codec_name != name:
+            continue
+
+        try:
+            return factory()
+        except ImportError:
+            if name:
+                logger.warning("JSON codec %s is not installed, using default", name)
+                return get_codec()
+
+    raise ValueError("Unknown JSON codec: {}".format(name))
+
+
+FrameHeader = namedtuple("FrameHeader", ["id", "type", "event_type", "entity_id"])
+
+
+class FrameDecoder:
+    """
+    Decodes HA websocket frames.
+
+    `peek` extracts the message `id` and `type` and, for events, the
+    `event_type` and `entity_id` from a raw frame without parsing it.
+    It only recognizes the key order HA uses when serializing messages,
+    for any other layout the unknown fields are returned as None.
+
+    """
+    WHITESPACE_RE = re.compile(r"\s*")
+    HEADER_RE = re.compile(r'\{\s*"id"\s*:\s*(\d+)\s*,\s*"type"\s*:\s*"(\w+)"')
+    EVENT_RE = re.compile(
+        r'\s*,\s*"event"\s*:\s*\{\s*"event_type"\s*:\s*"(\w+)"'
+        r'\s*,\s*"data"\s*:\s*\{\s*"entity_id"\s*:\s*"([^"\\]+)"')
+    STATES_RESULT_RE = re.compile(
+        r'\{\s*"id"\s*:\s*\d+\s*,\s*"type"\s*:\s*"result"\s*,\s*"success"\s*:\s*true'
+        r'\s*,\s*"result"\s*:\s*\[')
+    STATE_START_RE = re.compile(r'\s*\{\s*"entity_id"\s*:')
+
+    def __init__(self, codec=None):
+        self.codec = codec or get_codec()
+        self.json_decoder = json.JSONDecoder()
+
+    def peek(self, frame):
+        header = self.HEADER_RE.match(frame)
+        if not header:
+            return FrameHeader(None, None, None, None)
+
+        request_id, message_type = int(header.group(1)), header.group(2)
+
+        event = None
+        if message_type == "event":
+            event = self.EVENT_RE.match(frame, header.end())
+
+        if not event:
+            return FrameHeader(request_id, message_type, None, None)
+
+        return FrameHeader(request_id, message_type, event.group(1), event.group(2))
+
+    def decode(self, frame):
+        return self.codec.loads(frame)
+
+    def decode_states(self, frame, entity_ids):
+        """
+        Returns a dict with the states of `entity_ids` found in a
+        successful `get_states` result frame, or None if `frame` is not
+        one.
+
+        Only the requested states are decoded, the result list itself is
+        never built. If states are serialized with `entity_id` as their
+        first key, as HA does, they are located with a single regular
+        expression search, otherwise the list is decoded state by state.
+
+        """
+        result = self.STATES_RESULT_RE.match(frame)
+        if not result:
+            return None
+
+        entity_ids = set(entity_ids)
+        if not entity_ids:
+            return {}
+
+        if self.STATE_START_RE.match(frame, result.end()):
+            return self._find_states(frame, result.end(), entity_ids)
+        else:
+            return self._scan_states(frame, result.end(), entity_ids)
+
+    def _find_states(self, frame, pos, entity_ids):
+        states = {}
+        state_re = re.compile(r'\{\s*"entity_id"\s*:\s*"(%s)"' % "|".join(re.escape(x) for x in entity_ids))
+
+        for match in state_re.finditer(frame, pos):
+            state, _ = self.json_decoder.raw_decode(frame, match.start())
+            # skip nested objects that happen to look like a state
+            if "state" in state:
+                states[match.group(1)] = state
+
+        return states
+
+    def _scan_states(self, frame, pos, entity_ids):
+        states = {}
+        pos = self.WHITESPACE_RE.match(frame, pos).end()
+
+        while frame[pos] != "]":
+            state, pos = self.json_decoder.raw_decode(frame, pos)
+            if state.get("entity_id") in entity_ids:
+                states[state["entity_id"]] = state
+
+            pos = self.WHITESPACE_RE.match(frame, pos).end()
+            if frame[pos] == ",":
+                pos = self.WHITESPACE_RE.match(frame, pos + 1).end()
+
+        return states
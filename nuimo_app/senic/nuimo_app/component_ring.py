@@ -0,0 +1,86 @@
+from threading import Lock
+
+from . import icons
+
+
+class ComponentRing:
+    """
+    Components in the order they're switched through, the last one is
+    followed by the first one.
+
+    Keeps the position of every component and its icon with the position
+    marked, see `icons.icon_with_index`, so that switching components
+    doesn't search the list or rebuild icons. Both are only updated for
+    the components following one that is removed.
+
+    """
+    def __init__(self):
+        self.components = []
+        self.positions = {}  # component: index
+        self.icons = {}  # component: icon with index
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.components)
+
+    def __iter__(self):
+        return iter(list(self.components))
+
+    def __contains__(self, component):
+        return component in self.positions
+
+    def add(self, component):
+        with self.lock:
+            if component in self.positions:
+                return
+
+            self.components.append(component)
+            self.update_positions(len(self.components) - 1)
+
+    def remove(self, component):
+        with self.lock:
+            index = self.positions.pop(component, None)
+            if index is None:
+                return
+
+            del self.components[index]
+            del self.icons[component]
+            self.update_positions(index)
+
+    def update_positions(self, start):
+        for index in range(start, len(self.components)):
+            component = self.components[index]
+            self.positions[component] = index
+            self.icons[component] = icons.icon_with_index(component.ICON, index)
+
+    def first(self):
+        return self.components[0] if self.components else None
+
+    def prev(self, component):
+        """
+        Returns the component before `component`, the first component
+        if it's not in the ring.
+
+        """
+        with self.lock:
+            index = self.positions.get(component)
+            if index is None:
+                return self.first()
+
+            return self.components[index - 1]
+
+    def next(self, component):
+        """
+        Returns the component after `component`, the first component if
+        it's not in the ring.
+
+        """
+        with self.lock:
+            index = self.positions.get(component)
+            if index is None:
+                return self.first()
+
+            return self.components[(index + 1) % len(self.components)]
+
+    def icon(self, component):
+        return self.icons[component]
@@ -6,7 +6,9 @@ from random import random, seed
 from . import icons
 
 from .actions import Action
+from .entity_states import EntityStates
 from .led import LEDMatrixConfig
+from .quantize import PerceptualScale
 
 
 COLOR_WHITE_RGB = (255, 255, 255)
@@ -16,6 +18,60 @@ logger = logging.getLogger(__name__)
 
 
 class Component:
+    # gesture name: name of the method handling it, rotation is handled
+    # by `rotation`
+    GESTURE_HANDLERS = {
+        "BUTTON_PRESS": "button_press",
+        "SWIPE_LEFT": "swipe_left",
+        "SWIPE_RIGHT": "swipe_right",
+        "FLY_LEFT": "swipe_left",
+        "FLY_RIGHT": "swipe_right",
+    }
+
+    # methods gestures can be mapped to
+    HANDLER_NAMES = ("button_press", "swipe_left", "swipe_right")
+
+    # rotation value that sweeps the whole scale
+    ROTATION_RANGE = 1800
+
+    # rotation too small for a step of the scale, applied with the next
+    # rotation
+    rotation_remainder = 0
+
+    def rotation_steps(self, value, scale):
+        """
+        Returns the number of `scale` steps `value` rotates by.
+
+        """
+        step_size = self.ROTATION_RANGE / len(scale)
+        value += self.rotation_remainder
+        steps = int(value / step_size)
+        self.rotation_remainder = value - steps * step_size
+        return steps
+
+    def gesture_handlers(self, overrides=None):
+        """
+        Returns a dict of gesture name: bound handler method.
+
+        `overrides` maps gesture names to handler names and replaces the
+        class defaults, an empty handler name unmaps the gesture.
+
+        """
+        handler_names = dict(self.GESTURE_HANDLERS)
+        handler_names.update(overrides or {})
+
+        handlers = {}
+        for gesture_name, handler_name in handler_names.items():
+            if not handler_name:
+                continue
+
+            if handler_name not in self.HANDLER_NAMES:
+                raise ValueError("Unknown gesture handler for {}: {}".format(gesture_name, handler_name))
+
+            handlers[gesture_name] = getattr(self, handler_name)
+
+        return handlers
+
     def state_changed(self, state):
         """
         Listen on state change notifications from HA.
@@ -31,12 +87,15 @@ class Component:
 
         self.set_state([new_state])
 
-    def make_action(self, service, led_matrix_config, **kw):
+    def make_action(self, service, led_matrix_config, entity_args=None, **kw):
         """
         Helper that returns an Action object.
 
         """
-        return Action(self.DOMAIN, service, self.entity_ids, led_matrix_config, **kw)
+        action = Action(self.DOMAIN, service, self.entity_ids, led_matrix_config, **kw)
+        action.entity_args = entity_args or {}
+        action.optimistic = self.optimistic
+        return action
 
 
 class PhilipsHue(Component):
@@ -51,16 +110,16 @@ class PhilipsHue(Component):
         "off": icons.LIGHT_OFF,
     }
 
-    def __init__(self, name, entities):
+    def __init__(self, name, entities, optimistic=False):
         self.name = name
 
         self.entity_ids = tuple(entities)
 
-        self.state = {}  # entity_id: state
-        self.brightness = {}  # entity_id: brightness
+        # show action results on the LED matrix before HA confirmed them
+        self.optimistic = optimistic
 
-        # if any of the lights is off we assume all are off
-        self.is_light_on = None
+        self.lights = EntityStates(self.entity_ids)  # state and brightness
+        self.brightness_scale = PerceptualScale(self.MAX_BRIGHTNESS_VALUE)
 
         # seed random nr generator (used to get random color value)
         seed()
@@ -73,14 +132,15 @@ class PhilipsHue(Component):
         for state in states:
             entity_id = state["entity_id"]
 
-            self.state[entity_id] = state["state"]
-            self.brightness[entity_id] = state["attributes"].get("brightness", 0)
+            brightness = state["attributes"].get("brightness", 0)
+            self.lights.update(entity_id, state["state"], brightness)
 
-            logger.debug(
-                "%s state: %s brightness: %s", entity_id, self.state[entity_id],
-                self.brightness[entity_id])
+            logger.debug("%s state: %s brightness: %s", entity_id, state["state"], brightness)
 
-        self.is_light_on = all(x == "on" for x in self.state.values())
+    @property
+    def is_light_on(self):
+        # if any of the lights is off we assume all are off
+        return self.lights.all_on()
 
     def button_press(self):
         """
@@ -102,36 +162,55 @@ class PhilipsHue(Component):
 
         Philips Hue brightness value is in range from 0 to 255 or
         (1-254 according to official docs) where 0 doesn't mean it's
-        off.
+        off. Rotation moves brightness along a perceptual scale, no
+        action is returned if that doesn't change it.
 
         """
-        delta = int(value / 1800 * self.MAX_BRIGHTNESS_VALUE)
-
-        for entity_id, brightness in self.brightness.items():
-            new_value = min([max([0, brightness + delta]), self.MAX_BRIGHTNESS_VALUE])
-            logger.debug("%s brightness current: %s delta: %s new: %s", entity_id,
-                         brightness, delta, new_value)
-
-            self.brightness[entity_id] = new_value
-
-        max_value = max(self.brightness.values())
-
-        # turn off bulbs if brightness has reached 0
+        steps = self.rotation_steps(value, self.brightness_scale)
+        if not steps:
+            return None
+
+        # every light moves by the same number of steps, so their
+        # brightness relative to each other is kept until they hit a
+        # limit
+        old_values = dict(self.lights.items())
+        scale = self.brightness_scale
+        # levels are compared, lights don't necessarily report a value of
+        # the scale, e.g. 254 instead of 255
+        if all(scale.step_index(v, steps) == scale.index(v) for v in old_values.values()):
+            logger.debug("brightness %s doesn't change with %s steps", old_values, steps)
+            return None
+
+        new_values = {k: scale.step(v, steps) for k, v in old_values.items()}
+
+        for entity_id, brightness in new_values.items():
+            self.lights.set_value(entity_id, brightness)
+        logger.debug("brightness steps: %s current: %s new: %s", steps, old_values, new_values)
+
+        max_value = max(new_values.values())
+
+        # turn off bulbs if brightness has reached 0, every other level of
+        # the scale keeps them on
         args = dict(transition=0)
-        if max_value > 1:
+        entity_args = None
+        if max_value > 0:
             service = "turn_on"
-            args["brightness"] = max_value
+            # absolute brightness, a step along the scale changes lights
+            # of different brightness by different values, so HA's
+            # relative brightness_step can't apply it. One call for
+            # every distinct brightness.
+            entity_args = {k: {"brightness": v} for k, v in new_values.items()}
             icon = icons.light_bar(self.MAX_BRIGHTNESS_VALUE, max_value)
         else:
             service = "turn_off"
             icon = icons.POWER_OFF
 
         led_cfg = LEDMatrixConfig(icon, fading=True, ignore_duplicates=True)
-        return self.make_action(service, led_cfg, **args)
+        return self.make_action(service, led_cfg, entity_args, **args)
 
     def swipe_left(self):
         led_cfg = LEDMatrixConfig(icons.LETTER_W)
-        brightness = max(self.brightness.values())
+        brightness = max(x for _, x in self.lights.items())
         return self.make_action("turn_on", led_cfg, rgb_color=COLOR_WHITE_RGB, brightness=brightness)
 
     def swipe_right(self):
@@ -151,13 +230,16 @@ class Sonos(Component):
         "paused": icons.PAUSE,
     }
 
-    def __init__(self, name, entities):
+    def __init__(self, name, entities, optimistic=False):
         self.name = name
 
         self.entity_ids = tuple(entities)
 
-        self.state = {}  # entity_id: state
-        self.volume = {}  # entity_id: volume
+        # show action results on the LED matrix before HA confirmed them
+        self.optimistic = optimistic
+
+        self.speakers = EntityStates(self.entity_ids, on_states=["playing"])  # state and volume
+        self.volume_scale = PerceptualScale(self.MAX_VOLUME_VALUE, steps=50, gamma=1.5, digits=2)
 
     def set_state(self, states):
         """
@@ -167,11 +249,10 @@ class Sonos(Component):
         for state in states:
             entity_id = state["entity_id"]
 
-            self.state[entity_id] = state["state"]
-            self.volume[entity_id] = state["attributes"].get("volume_level", 0)
+            volume = state["attributes"].get("volume_level", 0)
+            self.speakers.update(entity_id, state["state"], volume)
 
-            logger.debug(
-                "%s state %s volume: %s", entity_id, self.state[entity_id], self.volume[entity_id])
+            logger.debug("%s state %s volume: %s", entity_id, state["state"], volume)
 
     def button_press(self):
         """
@@ -180,7 +261,7 @@ class Sonos(Component):
         NOTE: only works with one speaker currently.
 
         """
-        state = self.state[list(self.state.keys())[0]]
+        state = self.speakers.state(self.speakers.first())
 
         if state == "playing":
             service = "turn_off"
@@ -196,19 +277,31 @@ class Sonos(Component):
         """
         Sets value according to the rotation value.
 
-        Sonos volume level value is in the rang from 0.0 to 1.0
+        Sonos volume level value is in the rang from 0.0 to 1.0, rotation
+        moves it along a perceptual scale. No action is returned if that
+        doesn't change it.
 
         NOTE: only works with one speaker currently.
 
         """
-        entity_id = list(self.volume.keys())[0]
-        volume = self.volume[entity_id]
+        entity_id = self.speakers.first()
+        volume = self.speakers.value(entity_id)
+
+        steps = self.rotation_steps(value, self.volume_scale)
+        if not steps:
+            return None
+
+        # levels are compared, the volume isn't necessarily a value of
+        # the scale
+        if self.volume_scale.step_index(volume, steps) == self.volume_scale.index(volume):
+            logger.debug("volume %s doesn't change with %s steps", volume, steps)
+            return None
+
+        new_value = self.volume_scale.step(volume, steps)
 
-        delta = value / 1800
-        new_value = min([max([0, volume + delta]), self.MAX_VOLUME_VALUE])
-        logger.debug("volume %s current: %s delta: %s new: %s", entity_id, volume, delta, new_value)
+        logger.debug("volume %s current: %s steps: %s new: %s", entity_id, volume, steps, new_value)
 
-        self.volume[entity_id] = new_value
+        self.speakers.set_value(entity_id, new_value)
 
         icon = icons.light_bar(self.MAX_VOLUME_VALUE, new_value)
         led_cfg = LEDMatrixConfig(icon, fading=True, ignore_duplicates=True)
@@ -0,0 +1,126 @@
+import logging
+
+from collections import Counter
+from threading import Lock
+from time import monotonic
+
+
+# (domain, service): state entities have after the call, None if the
+# service doesn't change the state, services not listed are always
+# called
+SERVICE_STATES = {
+    ("light", "turn_on"): "on",
+    ("light", "turn_off"): "off",
+    ("media_player", "volume_set"): None,
+}
+
+# service data that doesn't change the resulting state
+IGNORED_SERVICE_ARGS = frozenset(["entity_id", "transition"])
+
+# how long the mirrored state of an entity can lag behind a completed
+# service call, e.g. until HA's state_changed event arrives
+DEFAULT_CONFIRMATION_PERIOD = 3  # seconds
+
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceCallFilter:
+    """
+    Finds entities whose mirrored HA state already is what a service call
+    would set, calling the service for them is redundant.
+
+    Service data other than the state has to match attributes of the
+    same name, e.g. `brightness`. Calls that change values relatively or
+    set data the state doesn't show are never redundant.
+
+    The mirror still shows the old state for a while after a call
+    completed. Until it shows what was sent, or `confirmation_period`
+    passed, calls for the entity are never redundant either.
+
+    """
+    def __init__(self, states, confirmation_period=DEFAULT_CONFIRMATION_PERIOD):
+        self.states = states  # entity_id: state, e.g. `HAListener.states`
+        self.skipped = Counter()  # "domain.service": nr of skipped calls by entity
+
+        self.confirmation_period = confirmation_period
+        # entity_id: (deadline, domain, service, data) of the last call
+        # the mirror might not show yet
+        self.unconfirmed = {}
+        self.lock = Lock()
+
+    def applied(self, domain, service, entity_ids, data, now=None):
+        """
+        Records a service call HA applied to `entity_ids`.
+
+        """
+        deadline = (now or monotonic()) + self.confirmation_period
+        with self.lock:
+            for entity_id in entity_ids:
+                self.unconfirmed[entity_id] = (deadline, domain, service, data)
+
+    def is_confirmed(self, entity_id, now=None):
+        """
+        Returns False while the mirrored state of `entity_id` might not
+        show the last call applied to it.
+
+        """
+        with self.lock:
+            call = self.unconfirmed.get(entity_id)
+            if not call:
+                return True
+
+            deadline, domain, service, data = call
+            if (now or monotonic()) < deadline and not self.is_redundant(domain, service, entity_id, data):
+                return False
+
+            del self.unconfirmed[entity_id]
+            return True
+
+    def is_redundant(self, domain, service, entity_id, data):
+        key = (domain, service)
+        if key not in SERVICE_STATES:
+            return False
+
+        state = self.states.get(entity_id)
+        if not state:
+            return False
+
+        expected_state = SERVICE_STATES[key]
+        if expected_state is not None and state["state"] != expected_state:
+            return False
+
+        attributes = state["attributes"]
+        for name, value in data.items():
+            if name in IGNORED_SERVICE_ARGS:
+                continue
+
+            current_value = attributes.get(name)
+            if isinstance(value, (list, tuple)) and isinstance(current_value, (list, tuple)):
+                value, current_value = list(value), list(current_value)
+
+            if current_value != value:
+                return False
+
+        return True
+
+    def redundant_entities(self, action, skip=()):
+        """
+        Returns the entities of `action` it doesn't need to be applied
+        to, leaving out the ones in `skip`.
+
+        """
+        entity_ids = []
+        for entity_id in action.entity_ids:
+            if entity_id in skip or not self.is_confirmed(entity_id):
+                continue
+
+            if self.is_redundant(action.domain, action.service, entity_id, action.service_data((entity_id,))):
+                entity_ids.append(entity_id)
+
+        if entity_ids:
+            self.skipped["{}.{}".format(action.domain, action.service)] += len(entity_ids)
+            logger.debug("Skipping %s.%s for %s, nothing would change", action.domain, action.service,
+                         ", ".join(entity_ids))
+
+        return entity_ids
@@ -0,0 +1,72 @@
+from sys import intern
+
+
+class EntityStates:
+    """
+    States and one attribute value, e.g. brightness, of a fixed set of
+    entities, kept in lists indexed by entity.
+
+    Entity ids and states are interned. The number of entities that are
+    in one of `on_states` is updated with every state, so nothing has to
+    look at all entities to find out if all of them are on. Entities
+    without a state yet are left out of everything but `entity_ids`.
+
+    """
+    __slots__ = ("entity_ids", "indexes", "states", "values", "on_states", "known_count", "on_count")
+
+    def __init__(self, entity_ids, on_states=("on",)):
+        self.entity_ids = tuple(intern(x) for x in entity_ids)
+        self.indexes = {x: i for i, x in enumerate(self.entity_ids)}
+        self.states = [None] * len(self.entity_ids)
+        self.values = [None] * len(self.entity_ids)
+        self.on_states = frozenset(on_states)
+
+        self.known_count = 0
+        self.on_count = 0
+
+    def __len__(self):
+        return self.known_count
+
+    def update(self, entity_id, state, value):
+        index = self.indexes.get(entity_id)
+        if index is None:
+            return
+
+        old_state = self.states[index]
+        if old_state is None:
+            self.known_count += 1
+        elif old_state in self.on_states:
+            self.on_count -= 1
+
+        if state in self.on_states:
+            self.on_count += 1
+
+        self.states[index] = intern(state)
+        self.values[index] = value
+
+    def state(self, entity_id):
+        return self.states[self.indexes[entity_id]]
+
+    def value(self, entity_id):
+        return self.values[self.indexes[entity_id]]
+
+    def set_value(self, entity_id, value):
+        self.values[self.indexes[entity_id]] = value
+
+    def all_on(self):
+        return self.on_count == self.known_count
+
+    def first(self):
+        """
+        Returns the first entity with a state, None if there's none.
+
+        """
+        return next((x for x, state in zip(self.entity_ids, self.states) if state is not None), None)
+
+    def items(self):
+        """
+        Returns (entity_id, value) of entities with a state.
+
+        """
+        return [(x, value) for x, state, value in zip(self.entity_ids, self.states, self.values)
+                if state is not None]
@@ -1,2 +1,21 @@
 class NuimoControllerConnectionError(Exception):
     pass
+
+
+class HARequestError(Exception):
+    """
+    Raised for requests that Home Assistant answered unsuccessfully.
+
+    """
+    def __init__(self, request, error):
+        super().__init__("{} request {} failed: {}".format(request["type"], request["id"], error))
+        self.request = request
+        self.error = error
+
+
+class HARequestTimeoutError(HARequestError):
+    pass
+
+
+class HAConnectionError(HARequestError):
+    pass
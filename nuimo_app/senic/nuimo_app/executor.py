@@ -0,0 +1,109 @@
+import logging
+
+from collections import Counter
+from functools import partial
+from queue import Queue
+from threading import Lock, Thread
+
+
+DEFAULT_NUM_WORKERS = 1
+
+
+logger = logging.getLogger(__name__)
+
+
+def listener_key(callback):
+    """
+    Returns the listener a callback belongs to, callbacks of partials
+    with different arguments belong to the same listener.
+
+    """
+    while isinstance(callback, partial):
+        callback = callback.func
+    return callback
+
+
+class CallbackExecutor:
+    """
+    Runs callbacks on worker threads instead of the thread that
+    submits them.
+
+    All callbacks of a listener run on the same worker in the order they
+    were submitted. State changed events of an entity that wait to be
+    delivered to a listener are collapsed, the listener only gets the
+    latest of them.
+
+    """
+    STOP = object()
+
+    def __init__(self, num_workers=DEFAULT_NUM_WORKERS):
+        self.queues = [Queue() for _ in range(num_workers)]
+        self.workers = [Thread(target=self.work, args=(x,), daemon=True) for x in self.queues]
+
+        self.lock = Lock()
+        self.pending_events = {}  # (listener, entity_id): payload
+
+        self.stats = Counter()  # submitted, collapsed, failed
+        self.max_queue_depth = 0
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        for queue in self.queues:
+            queue.put((self.STOP, None))
+
+    def join(self):
+        """
+        Blocks until all submitted callbacks have run.
+
+        """
+        for queue in self.queues:
+            queue.join()
+
+    def queue_depths(self):
+        return [x.qsize() for x in self.queues]
+
+    def submit(self, callback, *args):
+        self.stats["submitted"] += 1
+        self.put(callback, (callback, args))
+
+    def submit_event(self, callback, entity_id, payload):
+        key = (callback, entity_id)
+
+        with self.lock:
+            collapse = key in self.pending_events
+            self.pending_events[key] = payload
+
+        if collapse:
+            self.stats["collapsed"] += 1
+        else:
+            self.stats["submitted"] += 1
+            self.put(callback, (self.run_event, (key,)))
+
+    def put(self, callback, item):
+        queue = self.queues[hash(listener_key(callback)) % len(self.queues)]
+        queue.put(item)
+        self.max_queue_depth = max(self.max_queue_depth, queue.qsize())
+
+    def run_event(self, key):
+        with self.lock:
+            payload = self.pending_events.pop(key)
+
+        callback, _ = key
+        callback(payload)
+
+    def work(self, queue):
+        while True:
+            callback, args = queue.get()
+            try:
+                if callback is self.STOP:
+                    break
+
+                callback(*args)
+            except Exception:
+                self.stats["failed"] += 1
+                logger.exception("Callback %s failed", callback)
+            finally:
+                queue.task_done()
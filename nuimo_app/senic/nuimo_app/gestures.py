@@ -0,0 +1,99 @@
+import logging
+
+from collections import Counter, deque
+from threading import Condition, Thread
+
+
+DEFAULT_MAX_SIZE = 32
+
+
+logger = logging.getLogger(__name__)
+
+
+class GestureQueue:
+    """
+    Bounded queue of gesture events handed from the BLE event loop to a
+    worker thread that calls `process` for each of them.
+
+    A gesture from `merge_gestures`, i.e. rotation, is merged into the
+    last queued event if that is the same gesture. When the queue is
+    full the oldest queued gesture from `droppable_gestures` is dropped
+    to make room, if there's none the new event is dropped.
+
+    """
+    def __init__(self, process, merge_gestures=(), droppable_gestures=(), max_size=DEFAULT_MAX_SIZE):
+        self.process = process
+        self.merge_gestures = frozenset(merge_gestures)
+        self.droppable_gestures = frozenset(droppable_gestures)
+        self.max_size = max_size
+
+        self.events = deque()
+        self.condition = Condition()
+        self.stopping = False
+
+        self.stats = Counter()  # queued, merged, dropped
+
+        self.worker = Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.worker.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+
+    def __len__(self):
+        return len(self.events)
+
+    def put(self, event):
+        """
+        Queues `event`, never blocks.
+
+        """
+        with self.condition:
+            if (event.gesture in self.merge_gestures and self.events and
+               self.events[-1].gesture == event.gesture):
+                self.events[-1].value += event.value
+                self.stats["merged"] += 1
+                return
+
+            if len(self.events) >= self.max_size and not self.drop_event():
+                self.stats["dropped"] += 1
+                logger.warning("Gesture queue full, dropping %s", event)
+                return
+
+            self.events.append(event)
+            self.stats["queued"] += 1
+            self.condition.notify()
+
+    def drop_event(self):
+        for event in self.events:
+            if event.gesture in self.droppable_gestures:
+                self.events.remove(event)
+                self.stats["dropped"] += 1
+                logger.debug("Gesture queue full, dropping %s", event)
+                return True
+
+        return False
+
+    def get(self):
+        with self.condition:
+            while not self.events and not self.stopping:
+                self.condition.wait()
+
+            if self.stopping:
+                return None
+
+            return self.events.popleft()
+
+    def run(self):
+        while True:
+            event = self.get()
+            if event is None:
+                break
+
+            try:
+                self.process(event)
+            except Exception:
+                logger.exception("Processing gesture event %s failed", event)
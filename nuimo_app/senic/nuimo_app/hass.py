@@ -1,144 +1,793 @@
-import json
 import logging
+import re
 
 from collections import defaultdict
+from concurrent.futures import Future, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import partial
+from itertools import count
 from pprint import pformat
-from threading import Thread
+from queue import Empty, PriorityQueue
+from threading import Event, Lock, Thread
+from time import monotonic, sleep
 
-from websocket import create_connection
+from websocket import WebSocketException, WebSocketTimeoutException, create_connection
+
+from .codec import FrameDecoder, get_codec
+from .executor import CallbackExecutor
+from .errors import HAConnectionError, HARequestError, HARequestTimeoutError
+from .metrics import LatencyHistograms
+from .pending_requests import DEFAULT_MAX_SIZE, DEFAULT_TIMEOUT, PendingRequests
+
+
+# how often the listener thread wakes up to expire requests
+TICK_INTERVAL = 1  # seconds
+
+# exponential backoff between attempts to reconnect to HA
+CONNECT_TIMEOUT = 5  # seconds
+RECONNECT_MIN_DELAY = 0.1  # seconds
+RECONNECT_MAX_DELAY = 1  # seconds
+
+# HA is pinged periodically to measure the bare round trip time, a ping
+# without answer means the connection is dead
+HEARTBEAT_INTERVAL = 30  # seconds
+HEARTBEAT_TIMEOUT = 10  # seconds
+
+# requests are written to HA in order of their priority, interactive
+# requests overtake bulk requests that wait to be written
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+PRIORITY_STOP = 2
+
+REQUEST_PRIORITIES = {
+    "call_service": PRIORITY_INTERACTIVE,
+    "ping": PRIORITY_INTERACTIVE,
+}
 
 
 logger = logging.getLogger(__name__)
 
 
+# minimal HA versions for optional websocket API features
+HA_FEATURES = {
+    "subscribe_entities": (2022, 4),
+}
+
+# service data changing a value relative to its current value, calls
+# with them can't replace each other
+RELATIVE_SERVICE_ARGS = ("brightness_step", "brightness_step_pct")
+
+# keys used by HA in `subscribe_entities` compressed states
+COMPRESSED_STATE_KEYS = {
+    "s": "state",
+    "a": "attributes",
+    "c": "context",
+    "lc": "last_changed",
+    "lu": "last_updated",
+}
+
+
+def gather(futures, timeout=None):
+    """
+    Waits until all `futures` are done and returns their results.
+
+    Raises `concurrent.futures.TimeoutError` if they aren't done within
+    `timeout` seconds and the exception of the first failed future if
+    any request failed.
+
+    """
+    done, not_done = wait(futures, timeout)
+    if not_done:
+        raise FutureTimeoutError("{} of {} requests not done".format(len(not_done), len(futures)))
+
+    return [x.result() for x in futures]
+
+
+def chain(source, target):
+    """
+    Resolves future `target` with the outcome of future `source`.
+
+    """
+    def copy_outcome(future):
+        if future.exception():
+            target.set_exception(future.exception())
+        else:
+            target.set_result(future.result())
+
+    source.add_done_callback(copy_outcome)
+
+
+def is_connection_error(future):
+    return isinstance(future.exception(), HAConnectionError)
+
+
+def is_replaceable(request):
+    """
+    Returns True if `request` is a service call that a later call of the
+    same service for the same entities makes unnecessary.
+
+    """
+    return (request is not None and request["type"] == "call_service" and
+            not any(x in request["service_data"] for x in RELATIVE_SERVICE_ARGS))
+
+
+def service_call_key(request):
+    entity_ids = request["service_data"].get("entity_id")
+    if isinstance(entity_ids, list):
+        entity_ids = tuple(entity_ids)
+
+    return request["domain"], request["service"], entity_ids
+
+
 class HAListener(Thread):
     """
     Listens on events & state change notification through HASS WS interface.
 
     """
-    def __init__(self, url, ws_connection=None):
+    def __init__(self, url, ws_connection=None, codec=None,
+                 request_timeout=DEFAULT_TIMEOUT, max_pending_requests=DEFAULT_MAX_SIZE, executor=None):
         super().__init__(daemon=True)
 
-        self.request_id = 1
+        # state listeners and request callbacks of callers run on the
+        # executor, never on the listener thread
+        self.executor = executor
+        if not self.executor:
+            self.executor = CallbackExecutor()
+            self.executor.start()
+
+        self.codec = get_codec(codec)
+        self.decoder = FrameDecoder(self.codec)
+        self.skipped_frames = 0
+
+        self.request_ids = count(1)
         self.event_subscription_id = None
+        self.subscribed_to_entities = False
+        self.ha_version = None
 
+        self.url = url
+        self.connected = Event()
         self.connection = ws_connection
         if not self.connection:
-            self.connect(url)
+            try:
+                self.connect(url)
+            except (WebSocketException, OSError) as e:
+                logger.error("Can't connect to Home Assistant: %s", e)
 
         self.stopping = False
-        self.response_callbacks = {}  # req_id: callback
-
-        self.state_listeners = defaultdict(list)  # {entity_id1, ...}: [callback, ...]
+        self.send_queue = PriorityQueue()  # (priority, req_id, request)
+        self.writer = Thread(target=self.write_requests, daemon=True)
+        self.pending_requests = PendingRequests(max_pending_requests, request_timeout)
+
+        # round trip times by request type and by called service
+        self.latencies = LatencyHistograms()
+        self.traces = {}  # request id: trace, see `call_service`
+        self.last_ping = monotonic()
+        self.ping_in_flight = False
+
+        self.state_listeners = defaultdict(list)  # (entity_id1, ...): [callback, ...]
+        self.entity_listeners = defaultdict(list)  # entity_id: [callback, ...]
+
+        # local mirror of HA states, filled once by `load_states` and
+        # kept up to date by state_changed events afterwards
+        self.states = {}  # entity_id: state
+        self.states_loaded = False
+        self.states_lock = Lock()
+        self.pending_state_requests = []  # [(entity_ids, future), ...]
+        self.states_request_id = None
 
     def connect(self, url):
-        self.connection = create_connection("{}/api/websocket".format(url))
-        result = json.loads(self.connection.recv())
-        logger.info("Connected to Home Assistant %s", result["ha_version"])
+        self.connection = create_connection("{}/api/websocket".format(url), timeout=CONNECT_TIMEOUT)
+        result = self.codec.loads(self.connection.recv())
+        self.ha_version = result.get("ha_version")
+        logger.info("Connected to Home Assistant %s", self.ha_version)
+
+    def supports(self, feature):
+        """
+        Returns True if the connected HA version supports `feature`.
+
+        """
+        if not self.ha_version:
+            return False
+
+        version = tuple(int(x) for x in re.findall(r"\d+", self.ha_version)[:3])
+        return version >= HA_FEATURES[feature]
 
     def prepare_request(self, request_type, **extra_args):
-        data = {"id": self.request_id, "type": request_type}
+        data = {"id": next(self.request_ids), "type": request_type}
         data.update(extra_args)
-        self.request_id += 1
         return data
 
-    def send_request(self, request, callback=None):
-        if callback:
-            self.response_callbacks[request["id"]] = callback
-
-        logger.debug("Sending request:")
-        logger.debug(pformat(request))
-        self.connection.send(json.dumps(request))
+    def send_request(self, request, callback=None, timeout=None):
+        """
+        Queues `request` for sending and returns a future for its result.
 
-        if not callback:
-            result = json.loads(self.connection.recv())
+        Requests are written by the writer thread while connected to
+        HA, ordered by priority of their type, see `REQUEST_PRIORITIES`.
 
-            if not (result["id"] == request["id"] and
-                    result["type"] == "result" and
-                    result["success"] is True):
+        The future is resolved by the listener thread with the result
+        message or fails with `HARequestError`, `HARequestTimeoutError`
+        if there's no result within `timeout` seconds or
+        `HAConnectionError` if the connection was lost after sending the
+        request. `callback` is added as a done callback of the future.
 
-                logger.error(result)
-                return None
+        """
+        future = Future()
+        if callback:
+            future.add_done_callback(callback)
+
+        if not self.pending_requests.add(request, future, timeout):
+            return future
+
+        priority = REQUEST_PRIORITIES.get(request["type"], PRIORITY_BULK)
+        self.send_queue.put((priority, request["id"], request))
+
+        return future
+
+    def write_requests(self):
+        while True:
+            self.connected.wait()
+
+            item = self.send_queue.get()
+            priority, _, request = item
+            if priority == PRIORITY_STOP:
+                break
+
+            # skip requests that timed out while waiting to be written
+            if request["id"] not in self.pending_requests:
+                continue
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Sending request:")
+                logger.debug(pformat(request))
+
+            connection = self.connection
+            try:
+                connection.send(self.codec.dumps(request))
+            except (WebSocketException, OSError) as e:
+                logger.error("Sending request %s failed: %s", request["id"], e)
+                if self.stopping:
+                    break
+
+                # keep the request for after reconnecting, the listener
+                # thread notices the broken connection when reading
+                self.send_queue.put(item)
+                if connection is self.connection:
+                    self.connected.clear()
+                    connection.shutdown()
             else:
-                return result
+                self.pending_requests.mark_sent(request["id"])
+
+                trace = self.traces.get(request["id"])
+                if trace:
+                    trace.mark("request_sent")
 
     def subscribe_to_events(self):
-        result = self.send_request(self.prepare_request("subscribe_events"))
-        if result:
-            self.event_subscription_id = result["id"]
+        """
+        Subscribes to the compressed `subscribe_entities` stream if HA
+        supports it, otherwise only to `state_changed` events.
+
+        Returns a future that is resolved once subscribed.
+
+        """
+        subscribed = Future()
+
+        def subscribe_events_callback(future):
+            if is_connection_error(future):
+                return
 
+            if future.exception():
+                logger.critical("Unable to subscribe to HA events: %s", future.exception())
+                subscribed.set_exception(future.exception())
+                self.stop()
+                return
+
+            self.event_subscription_id = future.result()["id"]
             logger.debug("Subscibed to events:")
-            logger.debug(pformat(result))
+            logger.debug(pformat(future.result()))
+
+            self.load_states()
+            subscribed.set_result(future.result())
+
+        def subscribe_entities_callback(future):
+            if is_connection_error(future):
+                return
+
+            if future.exception():
+                logger.warning("Unable to subscribe to entities, falling back to state_changed events")
+                subscribe_events()
+                return
+
+            # the entities subscription sends all states as its first event
+            self.event_subscription_id = future.result()["id"]
+            self.subscribed_to_entities = True
+            logger.debug("Subscribed to entities")
+
+            subscribed.set_result(future.result())
+
+        def subscribe_events():
+            request = self.prepare_request("subscribe_events", event_type="state_changed")
+            self.send_request(request, subscribe_events_callback)
+
+        if self.supports("subscribe_entities"):
+            self.send_request(self.prepare_request("subscribe_entities"), subscribe_entities_callback)
         else:
-            logger.critical("Unable to subscribe to HA events...")
-            raise ValueError("Error subscribing to HA Events")
+            subscribe_events()
+
+        return subscribed
 
     def run(self):
-        self.subscribe_to_events()
+        self.writer.start()
+
+        if self.connection:
+            self.resume()
 
         while not self.stopping:
+            if not self.connected.is_set():
+                self.reconnect()
+                continue
+
             logger.debug("waiting for HA events...")
-            result = json.loads(self.connection.recv())
+            try:
+                frame = self.connection.recv()
+            except WebSocketTimeoutException:
+                frame = None
+            except (WebSocketException, OSError) as e:
+                logger.error("Lost connection to Home Assistant: %s", e)
+                self.connection_lost()
+                continue
+
+            if frame:
+                try:
+                    self.process_message(frame)
+                except Exception:
+                    # a frame that can't be processed doesn't stop the
+                    # listener
+                    logger.exception("Processing message from Home Assistant failed: %r", frame)
+            elif frame == "":
+                # websocket-client returns an empty frame on close
+                logger.error("Home Assistant closed the connection")
+                self.connection_lost()
+                continue
+
+            self.pending_requests.expire()
+            self.send_heartbeat()
+
+    def send_heartbeat(self):
+        """
+        Pings HA every `HEARTBEAT_INTERVAL` seconds.
+
+        """
+        if self.ping_in_flight or monotonic() - self.last_ping < HEARTBEAT_INTERVAL:
+            return
+
+        def pong_callback(future):
+            self.ping_in_flight = False
+            # old HA versions answer pings with an unknown command error
+            # which proves the connection alive just as well
+            if isinstance(future.exception(), HARequestTimeoutError) and self.connected.is_set():
+                logger.error("No answer to ping from Home Assistant, reconnecting")
+                self.connection.shutdown()
+                self.connection_lost()
+
+        self.ping_in_flight = True
+        self.last_ping = monotonic()
+        self.send_request(self.prepare_request("ping"), pong_callback, HEARTBEAT_TIMEOUT)
+
+    def connection_lost(self):
+        self.connected.clear()
+        self.event_subscription_id = None
+        self.subscribed_to_entities = False
+
+        failed = self.pending_requests.fail_sent(lambda x: HAConnectionError(x, "connection lost"))
+        logger.debug("Failed %d requests waiting for their result", len(failed))
+
+    def reconnect(self):
+        """
+        Reconnects to HA with exponential backoff and resumes.
+
+        """
+        delay = RECONNECT_MIN_DELAY
+
+        while not self.stopping:
+            try:
+                self.connect(self.url)
+                break
+            except (WebSocketException, OSError) as e:
+                logger.warning("Can't connect to Home Assistant, retrying in %.1fs: %s", delay, e)
+
+            sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+            self.pending_requests.expire()
+        else:
+            return
+
+        self.resume()
 
-            if result["type"] == "event":
-                if (result["event"]["event_type"] == "state_changed" and
-                   result["id"] == self.event_subscription_id):
-                    self.process_event(result["event"])
+    def resume(self):
+        """
+        Subscribes to events on a new connection, queues the state
+        resync and lets the writer thread send queued requests.
 
-            elif result["type"] == "result":
-                if self.process_callbacks(result):
+        """
+        self.connection.settimeout(TICK_INTERVAL)
+        self.merge_queued_requests()
+        self.subscribe_to_events()
+        self.connected.set()
+
+    def merge_queued_requests(self):
+        """
+        Drops queued service calls that are followed by a call of the
+        same service for the same entities, unless they change values
+        relatively. Their futures are resolved with the outcome of the
+        latest call.
+
+        """
+        queued = []
+        while True:
+            try:
+                queued.append(self.send_queue.get_nowait())
+            except Empty:
+                break
+
+        latest = {}  # (domain, service, entity_ids): request
+        for _, _, request in sorted(queued, key=lambda x: x[1]):
+            if is_replaceable(request):
+                latest[service_call_key(request)] = request
+
+        for item in queued:
+            _, _, request = item
+            if is_replaceable(request):
+                latest_request = latest[service_call_key(request)]
+                if latest_request is not request:
+                    _, future = self.pending_requests.pop(request["id"])
+                    _, latest_future = self.pending_requests.get(latest_request["id"])
+                    if future and latest_future:
+                        chain(latest_future, future)
                     continue
+
+            self.send_queue.put(item)
+
+    def process_message(self, frame):
+        header = self.decoder.peek(frame)
+
+        if header.type == "result" and header.id == self.states_request_id:
+            if self.process_states_frame(frame):
+                return
+
+        if not self.subscribed_to_entities:
+            if (header.event_type == "state_changed" and
+               header.id == self.event_subscription_id and
+               header.entity_id not in self.entity_listeners):
+                # nobody listens on this entity, drop it from the mirror
+                # as it's no longer kept up to date
+                self.states.pop(header.entity_id, None)
+                self.skipped_frames += 1
+                return
+
+        result = self.decoder.decode(frame)
+
+        if result["type"] == "event":
+            if result["id"] != self.event_subscription_id:
+                logger.debug("Got event for unknown subscription: %s", result)
+            elif self.subscribed_to_entities:
+                self.process_entities_event(result["event"])
+            elif result["event"]["event_type"] == "state_changed":
+                self.process_event(result["event"])
+
+        elif result["type"] in ("result", "pong"):
+            if not self.process_result(result):
+                logger.debug("Got result for unknown request: %s", result)
+        else:
+            logger.debug("Unknown HA message: %s", result)
+
+    def process_entities_event(self, payload):
+        """
+        Turns a `subscribe_entities` event into `state_changed` events.
+
+        Added entities (`a`) carry their complete compressed state,
+        changed entities (`c`) only the diff to their previous state and
+        removed entities (`r`) only their ids.
+
+        """
+        for entity_id, compressed_state in payload.get("a", {}).items():
+            new_state = {"entity_id": entity_id, "attributes": {}}
+            new_state.update((COMPRESSED_STATE_KEYS[k], v) for k, v in compressed_state.items())
+            self.update_state(entity_id, new_state)
+
+        for entity_id, diff in payload.get("c", {}).items():
+            old_state = self.states.get(entity_id)
+            if not old_state:
+                logger.debug("Got state diff for unknown entity %s", entity_id)
+                continue
+
+            new_state = dict(old_state, attributes=dict(old_state["attributes"]))
+            for key, value in diff.get("+", {}).items():
+                if key == "a":
+                    new_state["attributes"].update(value)
                 else:
-                    logger.debug("Got result w/o callback: %s", result)
-            else:
-                logger.debug("Unknown HA message: %s", result)
+                    new_state[COMPRESSED_STATE_KEYS[key]] = value
+            for attribute in diff.get("-", {}).get("a", []):
+                new_state["attributes"].pop(attribute, None)
+
+            self.process_state_change(entity_id, new_state)
+
+        for entity_id in payload.get("r", []):
+            self.process_state_change(entity_id, None)
+
+        if not self.states_loaded:
+            self.finish_loading_states()
+
+    def update_state(self, entity_id, new_state):
+        """
+        Updates the state mirror and notifies listeners only if the
+        state differs from the mirrored one, e.g. after reconnecting.
+
+        """
+        old_state = self.states.get(entity_id)
+        if (old_state and old_state["state"] == new_state["state"] and
+           old_state["attributes"] == new_state["attributes"]):
+            self.states[entity_id] = new_state
+        else:
+            self.process_state_change(entity_id, new_state)
+
+    def process_state_change(self, entity_id, new_state):
+        self.process_event({
+            "event_type": "state_changed",
+            "data": {
+                "entity_id": entity_id,
+                "old_state": self.states.get(entity_id),
+                "new_state": new_state,
+            },
+        })
 
     def process_event(self, payload):
         entity_id = payload["data"]["entity_id"]
 
-        listeners_to_notify = [x for x in self.state_listeners if entity_id in x]
+        new_state = payload["data"].get("new_state")
+        if new_state is None:
+            self.states.pop(entity_id, None)
+        else:
+            self.states[entity_id] = new_state
+
+        callbacks = self.entity_listeners.get(entity_id)
+        if not callbacks:
+            return
+
+        # iterate over a copy, callbacks might (un)register listeners
+        for callback in tuple(callbacks):
+            self.executor.submit_event(callback, entity_id, payload)
 
-        for listener in listeners_to_notify:
-            callbacks = self.state_listeners[listener]
-            for callback in callbacks:
-                callback(payload)
+    def add_callback(self, future, callback):
+        """
+        Runs `callback` with `future` on the executor once it's done.
+
+        """
+        future.add_done_callback(partial(self.executor.submit, callback))
 
     def register_state_listener(self, entity_ids, callback):
         self.state_listeners[entity_ids].append(callback)
 
-    def unregister_state_listener(self, entity_ids):
-        self.state_listeners.pop(entity_ids, None)
+        for entity_id in entity_ids:
+            self.entity_listeners[entity_id].append(callback)
+
+    def unregister_state_listener(self, entity_ids, callback=None):
+        """
+        Removes `callback` registered for `entity_ids` or all callbacks
+        registered for `entity_ids` if no callback is given.
+
+        """
+        callbacks = self.state_listeners.get(entity_ids)
+        if not callbacks:
+            return
+
+        if callback is None:
+            removed = self.state_listeners.pop(entity_ids)
+        elif callback in callbacks:
+            callbacks.remove(callback)
+            removed = [callback]
+            if not callbacks:
+                del self.state_listeners[entity_ids]
+        else:
+            return
+
+        for entity_id in entity_ids:
+            entity_callbacks = self.entity_listeners.get(entity_id, [])
+            for cb in removed:
+                if cb in entity_callbacks:
+                    entity_callbacks.remove(cb)
+            if not entity_callbacks:
+                self.entity_listeners.pop(entity_id, None)
+
+    def process_result(self, result):
+        """
+        Resolves the future of the request `result` belongs to. Returns
+        False for results of unknown requests.
+
+        """
+        sent_time = self.pending_requests.sent_time(result["id"])
+        request, future = self.pending_requests.pop(result["id"])
+        if not future:
+            return False
+
+        if sent_time:
+            self.observe_latency(request, monotonic() - sent_time)
+
+        if result["type"] == "pong" or result["success"] is True:
+            future.set_result(result)
+        else:
+            logger.error("Request failed: %s", result)
+            future.set_exception(HARequestError(request, result.get("error")))
+
+        return True
+
+    def observe_latency(self, request, latency):
+        self.latencies.observe(request["type"], latency)
+        if request["type"] == "call_service":
+            name = "call_service {}.{}".format(request["domain"], request["service"])
+            self.latencies.observe(name, latency)
+
+    def format_stats(self):
+        """
+        Returns request statistics and latency histograms as text.
+
+        """
+        def format_counter(counter):
+            return ", ".join("{}: {}".format(k, v) for k, v in sorted(counter.items()))
+
+        return "\n".join([
+            "HA requests {}".format(format_counter(self.pending_requests.stats)),
+            "Callbacks {}, queue depths: {}, max queue depth: {}".format(
+                format_counter(self.executor.stats), self.executor.queue_depths(), self.executor.max_queue_depth),
+            "HA round trip times in ms:",
+            self.latencies.format(),
+        ])
+
+    def call_service(self, domain, service, data, callback=None, timeout=None, trace=None):
+        """
+        Calls a HA service. If `trace` is given the time the request is
+        sent and its result is received are marked in it, see
+        `tracing.Trace`.
+
+        """
+        request = self.prepare_request("call_service", domain=domain,
+                                       service=service, service_data=data)
+
+        if trace:
+            # before queueing the request so that the writer finds it
+            self.traces[request["id"]] = trace
+
+        future = self.send_request(request, timeout=timeout)
+
+        if trace:
+            def result_received(future):
+                self.traces.pop(request["id"], None)
+                trace.mark("result_received")
+
+            future.add_done_callback(result_received)
 
-    def process_callbacks(self, result):
-        callback = self.response_callbacks.pop(result["id"])
         if callback:
-            callback(result)
-        return callback
+            self.add_callback(future, callback)
 
-    def call_service(self, domain, service, data, callback):
-        request = self.prepare_request("call_service", domain=domain,
-                                       service=service, service_data=data)
+        return future
+
+    def load_states(self):
+        """
+        Fills the state mirror with a single `get_states` request and
+        answers all `get_state` calls that arrived in the meantime.
+
+        Only states of entities that are requested or listened on at the
+        time the response arrives are kept, see `process_states_frame`.
+
+        """
+        def load_states_callback(future):
+            if is_connection_error(future):
+                # states are loaded again after reconnecting
+                self.states_request_id = None
+                return
 
-        self.send_request(request, callback)
+            if future.exception():
+                self.process_states([])
+                return
+
+            entity_ids = self.wanted_entity_ids()
+            self.process_states(x for x in future.result()["result"] if x["entity_id"] in entity_ids)
 
-    def get_state(self, entity_ids, callback):
         request = self.prepare_request("get_states")
+        self.states_request_id = request["id"]
+        self.send_request(request, load_states_callback)
+
+    def process_states_frame(self, frame):
+        """
+        Picks the wanted states out of a raw `get_states` result frame
+        without decoding all the others. Returns False if the frame
+        can't be parsed that way.
+
+        """
+        states = self.decoder.decode_states(frame, self.wanted_entity_ids())
+        if states is None:
+            return False
+
+        request, future = self.pending_requests.pop(self.states_request_id)
+        if future:
+            # the result only contains the wanted states
+            future.set_result({"id": request["id"], "type": "result", "success": True,
+                               "result": list(states.values())})
+        return True
+
+    def process_states(self, states):
+        self.states_request_id = None
+
+        if self.states_loaded:
+            # resync, notify listeners about states changed meanwhile
+            for state in states:
+                self.update_state(state["entity_id"], state)
+        else:
+            self.states.update((x["entity_id"], x) for x in states)
 
-        def get_state_callback(response):
-            entity_states = []
-            for entity_id in entity_ids:
-                state = self.find_entity_state(response["result"], entity_id)
-                if not state:
-                    logger.error("Can't determine state of %s", entity_id)
-                else:
-                    entity_states.append(state)
+        self.finish_loading_states()
+
+    def wanted_entity_ids(self):
+        with self.states_lock:
+            entity_ids = set(self.entity_listeners)
+            for requested_entity_ids, _ in self.pending_state_requests:
+                entity_ids.update(requested_entity_ids)
+
+        return entity_ids
+
+    def finish_loading_states(self):
+        with self.states_lock:
+            self.states_loaded = True
+            pending_requests, self.pending_state_requests = self.pending_state_requests, []
+
+        logger.debug("Loaded %d entity states", len(self.states))
 
-            callback(entity_states)
+        for entity_ids, future in pending_requests:
+            future.set_result(self.lookup_states(entity_ids))
+
+    def get_state(self, entity_ids, callback=None):
+        """
+        Returns a future for the states of `entity_ids` taken from the
+        state mirror, resolved as soon as the mirror is loaded.
+
+        """
+        future = Future()
+        if callback:
+            self.add_callback(future, callback)
+
+        with self.states_lock:
+            if self.states_loaded and all(x in self.states for x in entity_ids):
+                pending = False
+            else:
+                # the mirror only holds states of entities that were
+                # requested or listened on, others have to be loaded
+                reload = self.states_loaded and not self.pending_state_requests
+                self.pending_state_requests.append((entity_ids, future))
+                pending = True
+
+        if not pending:
+            future.set_result(self.lookup_states(entity_ids))
+        elif reload:
+            self.load_states()
+
+        return future
+
+    def lookup_states(self, entity_ids):
+        entity_states = []
+        for entity_id in entity_ids:
+            state = self.states.get(entity_id)
+            if not state:
+                logger.error("Can't determine state of %s", entity_id)
+            else:
+                entity_states.append(state)
 
-        self.send_request(request, get_state_callback)
+        return entity_states
 
     def find_entity_state(self, states, entity_id):
         return next((x for x in states if x["entity_id"] == entity_id), None)
 
     def stop(self):
         self.stopping = True
+        self.send_queue.put((PRIORITY_STOP, next(self.request_ids), None))
+        # let the writer thread see the stop request
+        self.connected.set()
+        self.executor.stop()
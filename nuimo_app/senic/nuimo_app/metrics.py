@@ -0,0 +1,87 @@
+from bisect import bisect_left
+from threading import Lock
+
+
+# upper bounds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+
+
+class LatencyHistogram:
+    """
+    Counts latencies in fixed buckets, the last bucket holds all
+    latencies above the largest bucket bound.
+
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, latency):
+        self.counts[bisect_left(self.buckets, latency)] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def percentile(self, percent):
+        """
+        Returns the upper bound of the bucket holding the `percent`
+        percentile, or the largest latency seen if that is lower, e.g.
+        for the last bucket.
+
+        """
+        if not self.count:
+            return None
+
+        rank = percent / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class LatencyHistograms:
+    """
+    Latency histograms by name, safe to be updated from any thread.
+
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}  # name: LatencyHistogram
+        self.lock = Lock()
+
+    def observe(self, name, latency):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if not histogram:
+                histogram = self.histograms[name] = LatencyHistogram(self.buckets)
+            histogram.observe(latency)
+
+    def get(self, name):
+        return self.histograms.get(name)
+
+    def format(self):
+        """
+        Returns a text table with count, mean, percentiles and max
+        latency in ms for every histogram.
+
+        """
+        lines = ["{:<40} {:>7} {:>8} {:>8} {:>8} {:>8} {:>8}".format(
+            "name", "count", "mean", "p50", "p90", "p99", "max")]
+
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                values = [histogram.mean(), histogram.percentile(50), histogram.percentile(90),
+                          histogram.percentile(99), histogram.max]
+                lines.append("{:<40} {:>7} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f}".format(
+                    name, histogram.count, *[x * 1000 for x in values]))
+
+        return "\n".join(lines)
@@ -2,16 +2,37 @@ import logging
 
 from functools import partial
 from pprint import pformat
+from threading import Event, Thread
 
 from nuimo import (Controller, ControllerListener, Gesture)
 
 from .import errors, icons
+from .actions import ActionTracker
+from .component_ring import ComponentRing
+from .dedup import ServiceCallFilter
+from .gestures import GestureQueue
 from .led import LEDMatrixConfig
+from .rotation import RotationAggregator, accelerate
+from .tracing import Tracer
+
+
+# how often actions are checked for their deadline
+ACTION_EXPIRY_INTERVAL = 0.5  # seconds
 
 
 logger = logging.getLogger(__name__)
 
 
+def is_request_failure(error):
+    """
+    Returns True if HA answered a request unsuccessfully, as opposed to
+    not answering it in time or losing the connection.
+
+    """
+    return isinstance(error, errors.HARequestError) and not isinstance(
+        error, (errors.HARequestTimeoutError, errors.HAConnectionError))
+
+
 class NuimoControllerListener(ControllerListener):
     def started_connecting(self):
         mac = self.controller.mac_address
@@ -37,7 +58,10 @@ class NuimoControllerListener(ControllerListener):
         self.controller.connect()
 
     def received_gesture_event(self, event):
-        self.process_gesture_event(event)
+        # runs on the BLE event loop, gestures are processed by the
+        # gesture queue worker
+        event.trace = self.tracer.start(event.gesture.name)
+        self.gesture_queue.put(event)
 
 
 class NuimoApp(NuimoControllerListener):
@@ -56,21 +80,59 @@ class NuimoApp(NuimoControllerListener):
         Gesture.BUTTON_RELEASE,
     ]
 
+    # gestures handled before looking at dispatch tables
+    RESERVED_GESTURES = [
+        Gesture.ROTATION,
+    ] + GESTURES_TO_IGNORE
+
     def __init__(self, mac_address, ha_api, ble_adapter_name):
         super().__init__()
 
-        self.components = []
+        self.components = ComponentRing()
         self.active_component = None
 
+        # component: {gesture: handler}, built when components register
+        self.dispatch_tables = {}
+        # dispatch table of the active component
+        self.gesture_handlers = {}
+
+        # actions in flight by entity, actions of different entities
+        # don't wait for each other
+        self.actions = ActionTracker()
+        self.stopped = Event()
+        self.action_expiry = Thread(target=self.expire_actions, daemon=True)
+        self.action_expiry.start()
+
+        # rotation events are summed up and turned into actions at a
+        # fixed rate, see `rotate`
+        self.rotation = RotationAggregator(self.rotate)
+        self.rotation_action = None
+        # trace of the first rotation event summed up since the last
+        # rotation action
+        self.rotation_trace = None
+
+        # latency from gestures to LED updates, see `tracing`
+        self.tracer = Tracer()
+        self.rotation.start()
+
+        self.ha = ha_api
+
+        # skips service calls that wouldn't change the mirrored state
+        self.service_call_filter = ServiceCallFilter(self.ha.states)
+
+        # queued rotation is merged and touch events are dropped first
+        # when gestures come in faster than they are processed
+        self.gesture_queue = GestureQueue(
+            self.process_gesture_event,
+            merge_gestures=[Gesture.ROTATION],
+            droppable_gestures=self.TOUCH_GESTURES,
+        )
+        self.gesture_queue.start()
+
         self.controller = Controller(adapter_name=ble_adapter_name, mac_address=mac_address)
         self.controller.listener = self
         self.controller.connect()
 
-        self.rotation_value = 0
-        self.action_in_progress = None
-
-        self.ha = ha_api
-
     def process_gesture_event(self, event):
         if event.gesture in self.GESTURES_TO_IGNORE:
             logger.debug("Ignoring gesture event: %s", event)
@@ -78,7 +140,10 @@ class NuimoApp(NuimoControllerListener):
 
         logger.debug("Processing gesture event: %s", event)
 
-        if event.gesture in self.INTERNAL_GESTURES:
+        # components can take over internal gestures in their config
+        handler = self.gesture_handlers.get(event.gesture)
+
+        if not handler and event.gesture in self.INTERNAL_GESTURES:
             self.process_internal_gesture(event.gesture)
             return
 
@@ -87,13 +152,21 @@ class NuimoApp(NuimoControllerListener):
             self.show_error_icon()
             return
 
+        trace = getattr(event, "trace", None)
+
         if event.gesture == Gesture.ROTATION:
-            action = self.process_rotation(event.value)
-        else:
-            action = self.process_gesture(event.gesture)
+            if not self.rotation_trace:
+                self.rotation_trace = trace
+            self.rotation.add(event.value)
+            return
+
+        if not handler:
+            logger.debug("No handler for gesture %s in %s", event.gesture, self.active_component.name)
+            return
 
+        action = handler()
         if action:
-            self.execute_action(action)
+            self.execute_action(action, trace)
 
     def process_internal_gesture(self, gesture):
         if gesture == Gesture.SWIPE_UP:
@@ -112,120 +185,259 @@ class NuimoApp(NuimoControllerListener):
 
         self.show_active_component()
 
-    def process_rotation(self, rotation_value):
-        self.rotation_value += rotation_value
-
-        if not self.action_in_progress:
-            action = self.active_component.rotation(self.rotation_value)
-            self.rotation_value = 0
-            self.action_in_progress = action
-            return action
-
-    def process_gesture(self, gesture):
-        action = None
-
-        if gesture == Gesture.BUTTON_PRESS:
-            action = self.active_component.button_press()
-
-        elif gesture == Gesture.SWIPE_LEFT:
-            action = self.active_component.swipe_left()
-
-        elif gesture == Gesture.SWIPE_RIGHT:
-            action = self.active_component.swipe_right()
-
-        else:
-            # TODO handle all remaining gestures...
-            pass
-
-        return action
+    def rotate(self, rotation_value, velocity):
+        """
+        Called by the rotation aggregator with the rotation summed up
+        since the last call and its velocity, fast rotation is
+        accelerated. Returns True if an action was started, no rotation
+        is applied until it's completed.
 
-    def execute_action(self, action):
-        def call_service_callback(entity_id, response):
-            logger.debug("service_call response for %s:", entity_id)
-            logger.debug(pformat(response))
+        """
+        trace, self.rotation_trace = self.rotation_trace, None
 
-            status = response["success"]
-            action.entity_updated(entity_id, status)
+        if not self.active_component:
+            return False
+
+        action = self.active_component.rotation(accelerate(rotation_value, velocity))
+        if not action:
+            return False
+
+        self.rotation_action = action
+        self.execute_action(action, trace)
+        return True
+
+    def execute_action(self, action, trace=None):
+        if trace:
+            trace.mark("action_created")
+            trace.component = self.active_component.name
+            action.trace = trace
+
+        # the mirrored state of entities with actions in flight might
+        # not show their outcome yet
+        in_flight = set(x for y in self.actions.in_flight(action.entity_ids) for x in y.entity_ids)
+        redundant = self.service_call_filter.redundant_entities(action, skip=in_flight)
+
+        self.actions.start(action)
+
+        if action.optimistic:
+            self.update_led_matrix(action.led_matrix_config, trace)
+
+        def call_service(entity_ids, data):
+            callback = partial(call_service_callback, entity_ids, data)
+            self.ha.call_service(action.domain, action.service, data, callback, self.actions.timeout, action.trace)
+
+        def call_service_callback(entity_ids, data, future):
+            entities = ", ".join(entity_ids)
+            if not future.exception():
+                # the mirror doesn't show the new state right away
+                self.service_call_filter.applied(action.domain, action.service, entity_ids, data)
+
+            if action.timed_out:
+                logger.debug("Ignoring service_call response of timed out action for %s", entities)
+                return
+
+            error = future.exception()
+            if (error and len(entity_ids) > 1 and is_request_failure(error) and not action.superseded and
+               action.is_idempotent(data)):
+                # find out which entities failed, HA might have applied
+                # the call to some of them
+                logger.warning("Batched service_call for %s failed, calling it by entity: %s", entities, error)
+                for entity_id in entity_ids:
+                    call_service((entity_id,), action.service_data((entity_id,)))
+                return
+
+            if error:
+                logger.error("service_call for %s failed: %s", entities, error)
+            else:
+                logger.debug("service_call response for %s:", entities)
+                logger.debug(pformat(future.result()))
+
+            entities_updated(entity_ids, error is None)
+
+        def entities_updated(entity_ids, success):
+            for entity_id in entity_ids:
+                action.entity_updated(entity_id, success)
 
             # check if action has been already applied to all entities
             if action.is_complete():
-                if action.is_successful():
-                    matrix_config = action.led_matrix_config
-                else:
-                    matrix_config = LEDMatrixConfig(icons.ERROR)
+                self.actions.finish(action)
+
+                if action.superseded:
+                    # a newer action for the same entities shows its result
+                    logger.debug("Dropping result of superseded %s.%s", action.domain, action.service)
+                elif not action.is_successful():
+                    # also rolls back what optimistic actions showed
+                    self.show_error_icon()
+                elif not action.optimistic:
+                    self.update_led_matrix(action.led_matrix_config, action.trace)
+
+                self.action_finished(action)
+
+        # before calling services, their callbacks might complete the
+        # action right away
+        for entity_id in redundant:
+            action.entity_updated(entity_id, True)
+
+        service_calls = action.service_calls([x for x in action.entity_ids if x not in redundant])
+        for entity_ids, data in service_calls:
+            call_service(entity_ids, data)
+
+        if not service_calls:
+            # nothing to change, show the result
+            entities_updated(redundant, True)
+
+    def action_finished(self, action):
+        if action.trace:
+            self.tracer.finish(action.trace)
+
+        if action is self.rotation_action:
+            self.rotation_action = None
+            # apply rotation that was summed up meanwhile
+            self.rotation.action_completed()
+
+    def expire_actions(self):
+        """
+        Fails actions that didn't complete in time, e.g. because a HA
+        response got lost, so that they don't block further actions.
 
-                self.update_led_matrix(matrix_config)
+        """
+        while not self.stopped.wait(ACTION_EXPIRY_INTERVAL):
+            self.fail_expired_actions()
 
-                self.action_in_progress = None
+    def fail_expired_actions(self, now=None):
+        for action in self.actions.expire(now):
+            logger.error("%s.%s for %s timed out, timeouts so far: %s", action.domain, action.service,
+                         ", ".join(action.entity_ids), dict(self.actions.timeouts))
+            if not action.superseded:
+                # also rolls back what optimistic actions showed
+                self.show_error_icon()
 
-        for entity_id in action.entity_ids:
-            attributes = {"entity_id": entity_id}
-            attributes.update(action.extra_args)
+            self.action_finished(action)
 
-            callback = partial(call_service_callback, entity_id)
-            self.ha.call_service(action.domain, action.service, attributes, callback)
+    def register_component(self, component, gesture_overrides=None):
+        """
+        Registers `component` once its initial state is known.
 
-    def register_component(self, component):
-        def set_state(state):
+        `gesture_overrides` maps gesture names to handler names of the
+        component, see `Component.gesture_handlers`.
+
+        """
+        self.dispatch_tables[component] = self.build_dispatch_table(component, gesture_overrides)
+
+        # register a state_changed callback that is called every time
+        # there's a state changed event for any of entities known by the
+        # component. Right away, so that HA keeps the entities in its
+        # mirror and no event is missed until the initial state arrives.
+        self.ha.register_state_listener(component.entity_ids, component.state_changed)
+
+        def set_state(future):
+            if component not in self.dispatch_tables:
+                # unregistered while waiting for its state
+                return
+
+            future.result()
+            # the mirror also holds events that arrived since the future
+            # was resolved
+            state = self.ha.lookup_states(component.entity_ids)
             component.set_state(state)
-            self.components.append(component)
+            self.components.add(component)
             logger.debug("New component registered: %s initial state:", component.name)
             logger.debug(pformat(state))
 
-            # register a state_changed callback that is called
-            # every time there's a state changed event for any of
-            # entities known by the component
-            self.ha.register_state_listener(component.entity_ids, component.state_changed)
-
             # show active component if we can
             if not self.active_component and self.components:
                 self.set_active_component()
 
         self.ha.get_state(component.entity_ids, set_state)
 
-    def get_prev_component(self):
-        if not self.components:
-            return None
+    def build_dispatch_table(self, component, gesture_overrides=None):
+        dispatch_table = {}
+        for gesture_name, handler in component.gesture_handlers(gesture_overrides).items():
+            try:
+                gesture = Gesture[gesture_name.upper()]
+            except KeyError:
+                raise ValueError("Unknown gesture for {}: {}".format(component.name, gesture_name))
 
-        if self.active_component:
-            index = self.components.index(self.active_component)
-            return self.components[index-1]
-        else:
-            return self.components[0]
+            if gesture in self.RESERVED_GESTURES:
+                raise ValueError("Gesture can't be mapped for {}: {}".format(component.name, gesture_name))
 
-    def get_next_component(self):
-        if not self.components:
-            return None
+            dispatch_table[gesture] = handler
 
-        if self.active_component:
-            index = self.components.index(self.active_component)
-            try:
-                return self.components[index+1]
-            except IndexError:
-                return self.components[0]
+        return dispatch_table
+
+    def unregister_component(self, component):
+        """
+        Removes `component`, the next component becomes active if it's
+        the active one.
+
+        """
+        if self.dispatch_tables.pop(component, None) is None:
+            return
+
+        self.ha.unregister_state_listener(component.entity_ids, component.state_changed)
+        logger.debug("Component unregistered: %s", component.name)
+
+        if component not in self.components:
+            # its state didn't arrive yet
+            return
+
+        next_component = self.components.next(component)
+        self.components.remove(component)
+
+        if component is not self.active_component:
+            if self.active_component and self.controller.is_connected():
+                # the index of the active component might have changed
+                self.show_active_component()
+        elif next_component is component:
+            self.clear_active_component()
         else:
-            return self.components[0]
+            self.set_active_component(next_component)
+
+    def get_prev_component(self):
+        return self.components.prev(self.active_component)
+
+    def get_next_component(self):
+        return self.components.next(self.active_component)
 
     def set_active_component(self, component=None):
         active_component = None
 
         if component:
             active_component = component
-        elif self.components:
-            active_component = self.components[0]
+        else:
+            active_component = self.components.first()
 
         if active_component:
             logger.debug("active component: %s", active_component.name)
 
             if self.active_component:
-                self.ha.unregister_state_listener(self.active_component.entity_ids)
+                self.ha.unregister_state_listener(self.active_component.entity_ids, self.state_changed)
 
             self.active_component = active_component
+            self.gesture_handlers = self.dispatch_tables[active_component]
+            # rotation in flight for the previous component doesn't hold
+            # back rotation of the new one
+            self.rotation_action = None
+            self.rotation_trace = None
+            self.rotation.reset()
             self.ha.register_state_listener(self.active_component.entity_ids, self.state_changed)
 
             if self.controller.is_connected():
                 self.show_active_component()
 
+    def clear_active_component(self):
+        if self.active_component:
+            self.ha.unregister_state_listener(self.active_component.entity_ids, self.state_changed)
+
+        self.active_component = None
+        self.gesture_handlers = {}
+        self.rotation_action = None
+        self.rotation_trace = None
+        self.rotation.reset()
+
+        if self.controller.is_connected():
+            self.show_active_component()
+
     def state_changed(self, state):
         """
         Gets called whenever state changes in any device within
@@ -237,8 +449,7 @@ class NuimoApp(NuimoControllerListener):
 
     def show_active_component(self):
         if self.active_component:
-            index = self.components.index(self.active_component)
-            icon = icons.icon_with_index(self.active_component.ICON, index)
+            icon = self.components.icon(self.active_component)
         else:
             icon = icons.ERROR
 
@@ -247,13 +458,20 @@ class NuimoApp(NuimoControllerListener):
     def show_error_icon(self):
         self.update_led_matrix(LEDMatrixConfig(icons.ERROR))
 
-    def update_led_matrix(self, matrix_config):
+    def update_led_matrix(self, matrix_config, trace=None):
         self.controller.display_matrix(
             matrix_config.matrix,
             fading=matrix_config.fading,
             ignore_duplicates=matrix_config.ignore_duplicates,
         )
 
+        if trace:
+            trace.mark("led_written")
+
     def quit(self):
+        self.stopped.set()
+        self.gesture_queue.stop()
+        self.rotation.stop()
+
         if self.controller.is_connected():
             self.controller.disconnect()
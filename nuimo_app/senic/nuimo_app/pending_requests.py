@@ -0,0 +1,136 @@
+import heapq
+import logging
+
+from collections import Counter
+from threading import Lock
+from time import monotonic
+
+from .errors import HARequestError, HARequestTimeoutError
+
+
+DEFAULT_MAX_SIZE = 256
+DEFAULT_TIMEOUT = 10  # seconds
+
+
+logger = logging.getLogger(__name__)
+
+
+class PendingRequests:
+    """
+    Requests sent to HA that wait for their result.
+
+    The table holds at most `max_size` requests, further requests are
+    rejected. Every request has a deadline, kept in a heap, after which
+    `expire` fails its future with `HARequestTimeoutError`.
+
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, timeout=DEFAULT_TIMEOUT):
+        self.max_size = max_size
+        self.timeout = timeout
+
+        self.requests = {}  # req_id: (request, future)
+        self.sent = {}  # req_id: time the request was written to HA
+        self.deadlines = []  # heap of (deadline, req_id)
+        self.lock = Lock()
+
+        self.stats = Counter()  # added, resolved, rejected, timed_out, unknown
+
+    def __len__(self):
+        return len(self.requests)
+
+    def __iter__(self):
+        return iter(list(self.requests))
+
+    def __contains__(self, request_id):
+        return request_id in self.requests
+
+    def add(self, request, future, timeout=None):
+        """
+        Adds `request` waiting on `future`. Returns False and fails
+        `future` if the table is full.
+
+        """
+        with self.lock:
+            if len(self.requests) >= self.max_size:
+                self.stats["rejected"] += 1
+                rejected = True
+            else:
+                self.requests[request["id"]] = (request, future)
+                deadline = monotonic() + (timeout or self.timeout)
+                heapq.heappush(self.deadlines, (deadline, request["id"]))
+                self.stats["added"] += 1
+                rejected = False
+
+        if rejected:
+            logger.error("Too many pending requests, rejecting %s", request)
+            future.set_exception(HARequestError(request, "too many pending requests"))
+
+        return not rejected
+
+    def pop(self, request_id):
+        """
+        Removes and returns `(request, future)` for `request_id` or
+        `(None, None)` for unknown requests.
+
+        """
+        with self.lock:
+            entry = self.requests.pop(request_id, None)
+            self.sent.pop(request_id, None)
+            self.stats["resolved" if entry else "unknown"] += 1
+
+            # drop deadlines of resolved requests once they pile up
+            if len(self.deadlines) > 2 * len(self.requests) + self.max_size:
+                self.deadlines = [x for x in self.deadlines if x[1] in self.requests]
+                heapq.heapify(self.deadlines)
+
+        return entry or (None, None)
+
+    def expire(self, now=None):
+        """
+        Fails all requests past their deadline and returns them.
+
+        """
+        now = now or monotonic()
+        expired = []
+
+        with self.lock:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                _, request_id = heapq.heappop(self.deadlines)
+                entry = self.requests.pop(request_id, None)
+                self.sent.pop(request_id, None)
+                if entry:
+                    expired.append(entry)
+
+            self.stats["timed_out"] += len(expired)
+
+        for request, future in expired:
+            logger.error("Request timed out: %s", request)
+            future.set_exception(HARequestTimeoutError(request, "timeout"))
+
+        return expired
+
+    def get(self, request_id):
+        return self.requests.get(request_id, (None, None))
+
+    def mark_sent(self, request_id):
+        with self.lock:
+            if request_id in self.requests:
+                self.sent[request_id] = monotonic()
+
+    def sent_time(self, request_id):
+        return self.sent.get(request_id)
+
+    def fail_sent(self, error):
+        """
+        Fails all requests written to HA with `error(request)`, the
+        requests that weren't written yet stay pending.
+
+        """
+        with self.lock:
+            entries = [self.requests.pop(x) for x in self.sent]
+            self.sent.clear()
+
+        for request, future in entries:
+            future.set_exception(error(request))
+
+        return entries
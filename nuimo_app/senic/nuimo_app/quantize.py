@@ -0,0 +1,56 @@
+from bisect import bisect_left
+
+
+DEFAULT_STEPS = 32
+DEFAULT_GAMMA = 2.2
+
+
+class PerceptualScale:
+    """
+    Lookup table of levels between 0 and `max_value` that are spaced
+    evenly as perceived, e.g. for brightness or volume.
+
+    Perception is roughly a power function of the value, level `i` of
+    `steps` is `max_value * (i / steps) ** gamma` rounded to `digits`.
+    Levels that round to the same value are merged, so there may be less
+    than `steps` steps.
+
+    """
+    def __init__(self, max_value, steps=DEFAULT_STEPS, gamma=DEFAULT_GAMMA, digits=None):
+        self.max_value = max_value
+        self.levels = sorted(set(round(max_value * (x / steps) ** gamma, digits) for x in range(steps + 1)))
+
+    def __len__(self):
+        """
+        Returns the number of steps from 0 to `max_value`.
+
+        """
+        return len(self.levels) - 1
+
+    def index(self, value):
+        """
+        Returns the index of the level closest to `value`.
+
+        """
+        index = bisect_left(self.levels, value)
+        if index == len(self.levels):
+            return index - 1
+        if index and value - self.levels[index - 1] < self.levels[index] - value:
+            return index - 1
+        return index
+
+    def step_index(self, value, steps):
+        """
+        Returns the index of the level `steps` levels above, or below for
+        negative steps, the level closest to `value`.
+
+        """
+        return min(max(0, self.index(value) + steps), len(self.levels) - 1)
+
+    def step(self, value, steps):
+        """
+        Returns the level `steps` levels above, or below for negative
+        steps, the level closest to `value`.
+
+        """
+        return self.levels[self.step_index(value, steps)]
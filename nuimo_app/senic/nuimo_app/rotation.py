@@ -0,0 +1,104 @@
+import logging
+
+from threading import Event, Lock, Thread
+from time import monotonic
+
+
+DEFAULT_TICK_INTERVAL = 0.1  # seconds
+
+# rotation faster than this is accelerated, up to `MAX_ACCELERATION`
+# times for rotation that many times as fast
+ACCELERATION_THRESHOLD = 1800  # rotation value per second
+MAX_ACCELERATION = 3
+
+
+logger = logging.getLogger(__name__)
+
+
+def accelerate(value, velocity):
+    """
+    Returns rotation `value` scaled up for fast rotation, so that a fast
+    spin covers more of a range than turning slowly by the same value.
+
+    """
+    factor = min(max(1, abs(velocity) / ACCELERATION_THRESHOLD), MAX_ACCELERATION)
+    return value * factor
+
+
+class RotationAggregator:
+    """
+    Sums up rotation events and flushes them at a fixed tick rate.
+
+    `flush` is called with the rotation value summed up since the last
+    flush and the rotation velocity in value per second. It returns
+    True if it started an action, in which case nothing is flushed
+    until `action_completed` is called. Rotation left over at that time
+    is flushed right away.
+
+    """
+    def __init__(self, flush, tick_interval=DEFAULT_TICK_INTERVAL):
+        self.flush_callback = flush
+        self.tick_interval = tick_interval
+
+        self.lock = Lock()
+        self.value = 0
+        self.velocity = 0
+        self.last_flush = monotonic()
+        self.action_in_progress = False
+
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.tick_interval):
+            self.tick()
+
+    def add(self, value):
+        with self.lock:
+            self.value += value
+
+    def tick(self):
+        if not self.action_in_progress:
+            self.flush()
+
+    def action_completed(self):
+        self.action_in_progress = False
+        self.flush()
+
+    def reset(self):
+        with self.lock:
+            self.value = 0
+            self.action_in_progress = False
+
+    def flush(self):
+        now = monotonic()
+
+        with self.lock:
+            value, self.value = self.value, 0
+            if not value:
+                self.last_flush = now
+                return
+
+            self.velocity = value / max(now - self.last_flush, self.tick_interval)
+            self.last_flush = now
+            self.action_in_progress = True
+
+        logger.debug("rotation: %s velocity: %.0f/s", value, self.velocity)
+
+        # the action might already be completed when `flush` returns, so
+        # only reset the flag if no action was started
+        try:
+            started = self.flush_callback(value, self.velocity)
+        except Exception:
+            # only this rotation is lost, the aggregator keeps running
+            logger.exception("Flushing rotation %s failed", value)
+            started = False
+
+        if not started:
+            self.action_in_progress = False
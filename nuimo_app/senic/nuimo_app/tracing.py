@@ -0,0 +1,65 @@
+from collections import deque
+from threading import Lock
+from time import monotonic
+
+from .metrics import LatencyHistograms
+
+
+DEFAULT_MAX_TRACES = 1024
+
+
+class Trace:
+    """
+    Timestamps of what happened from receiving a gesture over BLE until
+    the result of the action it triggered was shown on the LED matrix.
+
+    Spans are `action_created`, `request_sent`, `result_received` and
+    `led_written`, their durations are measured from `start`.
+
+    A span marked more than once, e.g. the result of an action for
+    several entities, keeps the latest timestamp.
+
+    """
+    def __init__(self, gesture, start=None):
+        self.gesture = gesture
+        self.component = None
+        self.start = monotonic() if start is None else start
+        self.timestamps = {}  # span: timestamp
+
+    def mark(self, span):
+        self.timestamps[span] = monotonic()
+
+    def durations(self):
+        return {span: timestamp - self.start for span, timestamp in self.timestamps.items()}
+
+
+class Tracer:
+    """
+    Keeps the last `max_traces` finished traces and summarizes them as
+    latency percentiles by gesture, component and span.
+
+    """
+    def __init__(self, max_traces=DEFAULT_MAX_TRACES):
+        self.traces = deque(maxlen=max_traces)
+        self.lock = Lock()
+
+    def start(self, gesture):
+        return Trace(gesture)
+
+    def finish(self, trace):
+        with self.lock:
+            self.traces.append(trace)
+
+    def histograms(self):
+        with self.lock:
+            traces = list(self.traces)
+
+        histograms = LatencyHistograms()
+        for trace in traces:
+            for span, duration in trace.durations().items():
+                histograms.observe("{} {} {}".format(trace.gesture, trace.component, span), duration)
+
+        return histograms
+
+    def format(self):
+        return self.histograms().format()
@@ -0,0 +1,87 @@
+"""
+Stand-in for the `nuimo` module, importing it needs BLE support through
+dbus. Import this module before anything that imports `nuimo`.
+
+"""
+import sys
+import types
+
+from enum import Enum
+
+
+class Gesture(Enum):
+    BUTTON_PRESS = 1
+    BUTTON_RELEASE = 2
+    SWIPE_LEFT = 3
+    SWIPE_RIGHT = 4
+    SWIPE_UP = 5
+    SWIPE_DOWN = 6
+    TOUCH_LEFT = 8
+    TOUCH_RIGHT = 9
+    TOUCH_TOP = 10
+    TOUCH_BOTTOM = 11
+    LONGTOUCH_LEFT = 12
+    LONGTOUCH_RIGHT = 13
+    LONGTOUCH_TOP = 14
+    LONGTOUCH_BOTTOM = 15
+    ROTATION = 16
+    FLY_LEFT = 17
+    FLY_RIGHT = 18
+    FLY_UPDOWN = 19
+    BATTERY_LEVEL = 20
+
+
+class GestureEvent:
+    def __init__(self, gesture, value=None):
+        self.gesture = gesture
+        self.value = value
+
+
+class LedMatrix:
+    def __init__(self, string):
+        self.string = string
+
+    def __eq__(self, other):
+        return isinstance(other, LedMatrix) and self.string == other.string
+
+
+class ControllerListener:
+    pass
+
+
+class Controller:
+    """
+    Records the matrices displayed instead of talking to a controller.
+
+    """
+    def __init__(self, adapter_name=None, mac_address=None):
+        self.mac_address = mac_address
+        self.listener = None
+        self.displayed = []  # LedMatrix, ...
+
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def display_matrix(self, matrix, fading=False, ignore_duplicates=False):
+        self.displayed.append(matrix)
+
+
+class ControllerManager:
+    def run(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+nuimo = types.ModuleType("nuimo")
+for cls in [Gesture, GestureEvent, LedMatrix, ControllerListener, Controller, ControllerManager]:
+    setattr(nuimo, cls.__name__, cls)
+
+sys.modules.setdefault("nuimo", nuimo)
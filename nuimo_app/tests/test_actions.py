@@ -0,0 +1,81 @@
+from unittest import TestCase
+
+from senic.nuimo_app.actions import Action, ActionTracker
+
+
+class ActionTrackerTests(TestCase):
+    def test_newer_action_supersedes_older(self):
+        tracker = ActionTracker()
+        action1 = Action("light", "turn_on", ("light.k1", "light.k2"), None)
+        action2 = Action("light", "turn_on", ("light.k3",), None)
+        action3 = Action("light", "turn_off", ("light.k2",), None)
+
+        tracker.start(action1)
+        tracker.start(action2)
+        self.assertFalse(action1.superseded)
+
+        tracker.start(action3)
+        self.assertTrue(action1.superseded)
+        self.assertFalse(action2.superseded)
+        self.assertEqual(tracker.in_flight(("light.k1", "light.k2")), {action1, action3})
+
+        tracker.finish(action1)
+        self.assertEqual(tracker.in_flight(("light.k1", "light.k2")), {action3})
+
+    def test_expire(self):
+        tracker = ActionTracker(timeout=5)
+        action1 = Action("light", "turn_on", ("light.k1",), None)
+        action2 = Action("light", "turn_on", ("light.k2",), None)
+        tracker.start(action1)
+        tracker.start(action2)
+        action2.entity_updated("light.k2", True)
+        tracker.finish(action2)
+
+        self.assertEqual(tracker.expire(), [])
+
+        self.assertEqual(tracker.expire(now=tracker.deadlines[-1][0]), [action1])
+        self.assertTrue(action1.timed_out)
+        self.assertFalse(action2.timed_out)
+        self.assertEqual(tracker.in_flight(("light.k1",)), set())
+        self.assertEqual(tracker.timeouts, {"light.turn_on": 1})
+
+
+class ActionTests(TestCase):
+    def test_batched_service_calls(self):
+        action = Action("light", "turn_on", ("light.k1", "light.k2"), None, brightness=10)
+        self.assertTrue(action.batched)
+        self.assertEqual(action.service_calls(), [
+            (("light.k1", "light.k2"), {"entity_id": ["light.k1", "light.k2"], "brightness": 10}),
+        ])
+
+    def test_unbatched_service_calls(self):
+        action = Action("script", "turn_on", ("script.s1", "script.s2"), None)
+        self.assertFalse(action.batched)
+        self.assertEqual(action.service_calls(), [
+            (("script.s1",), {"entity_id": "script.s1"}),
+            (("script.s2",), {"entity_id": "script.s2"}),
+        ])
+
+        action = Action("light", "turn_on", ("light.k1",), None)
+        self.assertFalse(action.batched)
+        self.assertEqual(action.service_calls(), [(("light.k1",), {"entity_id": "light.k1"})])
+
+    def test_service_calls_by_entity_args(self):
+        action = Action("light", "turn_on", ("light.k1", "light.k2", "light.k3"), None, transition=0)
+        action.entity_args = {
+            "light.k1": {"brightness": 10},
+            "light.k2": {"brightness": 20},
+            "light.k3": {"brightness": 10},
+        }
+        self.assertEqual(action.service_calls(), [
+            (("light.k1", "light.k3"), {"entity_id": ["light.k1", "light.k3"], "transition": 0, "brightness": 10}),
+            (("light.k2",), {"entity_id": "light.k2", "transition": 0, "brightness": 20}),
+        ])
+
+    def test_is_idempotent(self):
+        action = Action("light", "turn_on", ("light.k1", "light.k2"), None)
+        self.assertTrue(action.is_idempotent({"entity_id": ["light.k1", "light.k2"], "brightness": 10}))
+        self.assertFalse(action.is_idempotent({"entity_id": ["light.k1", "light.k2"], "brightness_step": 10}))
+
+        action = Action("media_player", "media_next_track", ("media_player.s1", "media_player.s2"), None)
+        self.assertFalse(action.is_idempotent({"entity_id": ["media_player.s1", "media_player.s2"]}))
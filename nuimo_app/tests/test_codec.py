@@ -0,0 +1,65 @@
+import json
+
+from unittest import TestCase
+
+from senic.nuimo_app.codec import FrameDecoder, FrameHeader, get_codec
+
+
+STATE_CHANGED_FRAME = json.dumps({
+    "id": 2,
+    "type": "event",
+    "event": {
+        "event_type": "state_changed",
+        "data": {
+            "entity_id": "light.k1",
+            "old_state": None,
+            "new_state": {"entity_id": "light.k1", "state": "on"},
+        },
+    },
+})
+
+
+STATES = [
+    {"entity_id": "light.k1", "state": "on", "attributes": {"brightness": 10}},
+    {"entity_id": "light.k10", "state": "off", "attributes": {}},
+    {"entity_id": "group.all", "state": "on", "attributes": {"entity_id": ["light.k1", "light.k10"]}},
+]
+
+
+class FrameDecoderTests(TestCase):
+    def test_peek_state_changed_event(self):
+        decoder = FrameDecoder()
+        self.assertEqual(decoder.peek(STATE_CHANGED_FRAME), FrameHeader(2, "event", "state_changed", "light.k1"))
+
+    def test_peek_result(self):
+        decoder = FrameDecoder()
+        frame = json.dumps({"id": 3, "type": "result", "success": True, "result": None})
+        self.assertEqual(decoder.peek(frame), FrameHeader(3, "result", None, None))
+
+    def test_peek_unknown_layout(self):
+        decoder = FrameDecoder()
+        frame = json.dumps({"type": "event", "id": 2})
+        self.assertEqual(decoder.peek(frame), FrameHeader(None, None, None, None))
+
+    def test_get_codec(self):
+        self.assertEqual(get_codec("json").name, "json")
+        self.assertRaises(ValueError, get_codec, "xml")
+
+    def test_decode_states(self):
+        decoder = FrameDecoder()
+        frame = json.dumps({"id": 4, "type": "result", "success": True, "result": STATES})
+        self.assertEqual(decoder.decode_states(frame, ["light.k1", "group.all"]), {
+            "light.k1": STATES[0],
+            "group.all": STATES[2],
+        })
+
+    def test_decode_states_unknown_key_order(self):
+        decoder = FrameDecoder()
+        states = [dict(reversed(list(x.items()))) for x in STATES]
+        frame = json.dumps({"id": 4, "type": "result", "success": True, "result": states})
+        self.assertEqual(decoder.decode_states(frame, ["light.k10"]), {"light.k10": STATES[1]})
+
+    def test_decode_states_failed_result(self):
+        decoder = FrameDecoder()
+        frame = json.dumps({"id": 4, "type": "result", "success": False, "error": {}})
+        self.assertEqual(decoder.decode_states(frame, ["light.k1"]), None)
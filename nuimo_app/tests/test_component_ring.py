@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+from senic.nuimo_app import icons
+from senic.nuimo_app.component_ring import ComponentRing
+
+
+class Component:
+    ICON = icons.LIGHT_BULB
+
+
+class ComponentRingTests(TestCase):
+    def setUp(self):
+        self.ring = ComponentRing()
+        self.components = [Component(), Component(), Component()]
+        for component in self.components:
+            self.ring.add(component)
+
+    def test_navigation(self):
+        a, b, c = self.components
+        self.assertEqual(self.ring.next(a), b)
+        self.assertEqual(self.ring.next(c), a)
+        self.assertEqual(self.ring.prev(a), c)
+        self.assertEqual(self.ring.prev(b), a)
+
+        # unknown components lead to the first one
+        self.assertEqual(self.ring.next(None), a)
+        self.assertEqual(self.ring.prev(Component()), a)
+        self.assertIsNone(ComponentRing().next(None))
+
+    def test_icons(self):
+        for index, component in enumerate(self.components):
+            self.assertEqual(self.ring.icon(component), icons.icon_with_index(icons.LIGHT_BULB, index))
+
+    def test_remove(self):
+        a, b, c = self.components
+        self.ring.remove(a)
+        self.ring.remove(a)
+        self.assertNotIn(a, self.ring)
+        self.assertEqual(list(self.ring), [b, c])
+        self.assertEqual(self.ring.next(c), b)
+        self.assertEqual(self.ring.icon(c), icons.icon_with_index(icons.LIGHT_BULB, 1))
+
+        self.ring.add(a)
+        self.ring.add(a)
+        self.assertEqual(list(self.ring), [b, c, a])
+        self.assertEqual(self.ring.icon(a), icons.icon_with_index(icons.LIGHT_BULB, 2))
@@ -0,0 +1,76 @@
+from unittest import TestCase
+
+import nuimo_stub  # noqa: F401, before importing anything that imports nuimo
+
+from senic.nuimo_app.components import PhilipsHue
+
+
+def light_state(entity_id, state, brightness=None):
+    attributes = {"brightness": brightness} if brightness is not None else {}
+    return {"entity_id": entity_id, "state": state, "attributes": attributes}
+
+
+class PhilipsHueTests(TestCase):
+    def setUp(self):
+        self.component = PhilipsHue("Kitchen", ["light.k1"])
+        self.step = self.component.ROTATION_RANGE / len(self.component.brightness_scale)
+
+    def test_rotate_up_from_off(self):
+        self.component.set_state([light_state("light.k1", "off")])
+
+        action = self.component.rotation(self.step)
+        self.assertEqual(action.service, "turn_on")
+        self.assertEqual(action.service_calls(), [
+            (("light.k1",), {"entity_id": "light.k1", "transition": 0, "brightness": 1}),
+        ])
+
+    def test_rotate_down_to_off(self):
+        self.component.set_state([light_state("light.k1", "on", 3)])
+
+        action = self.component.rotation(-self.step)
+        self.assertEqual(action.service, "turn_on")
+        self.assertEqual(action.service_calls()[0][1]["brightness"], 1)
+
+        action = self.component.rotation(-self.step)
+        self.assertEqual(action.service, "turn_off")
+
+        # nothing left to turn down
+        self.assertIsNone(self.component.rotation(-self.step))
+
+    def test_rotate_up_at_max(self):
+        # Hue lights report 254 at most
+        self.component.set_state([light_state("light.k1", "on", 254)])
+        self.assertIsNone(self.component.rotation(self.step))
+
+    def test_rotate_up_with_one_light_at_max(self):
+        component = PhilipsHue("Kitchen", ["light.k1", "light.k2"])
+        component.set_state([light_state("light.k1", "on", 254), light_state("light.k2", "on", 100)])
+
+        action = component.rotation(self.step)
+        self.assertEqual(action.entity_args["light.k1"], {"brightness": 255})
+        self.assertGreater(action.entity_args["light.k2"]["brightness"], 100)
+
+
+class GestureHandlersTests(TestCase):
+    def setUp(self):
+        self.component = PhilipsHue("Kitchen", ["light.k1"])
+
+    def test_defaults(self):
+        handlers = self.component.gesture_handlers()
+        self.assertEqual(handlers["BUTTON_PRESS"], self.component.button_press)
+        self.assertEqual(handlers["FLY_LEFT"], self.component.swipe_left)
+        self.assertNotIn("LONGTOUCH_TOP", handlers)
+
+    def test_overrides(self):
+        handlers = self.component.gesture_handlers({
+            "LONGTOUCH_TOP": "button_press",
+            "SWIPE_LEFT": "swipe_right",
+            "FLY_LEFT": "",
+        })
+        self.assertEqual(handlers["LONGTOUCH_TOP"], self.component.button_press)
+        self.assertEqual(handlers["SWIPE_LEFT"], self.component.swipe_right)
+        self.assertNotIn("FLY_LEFT", handlers)
+
+    def test_unknown_handler(self):
+        with self.assertRaises(ValueError):
+            self.component.gesture_handlers({"TOUCH_TOP": "set_state"})
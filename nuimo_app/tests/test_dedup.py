@@ -0,0 +1,52 @@
+from unittest import TestCase
+
+from senic.nuimo_app.actions import Action
+from senic.nuimo_app.dedup import ServiceCallFilter
+
+
+class ServiceCallFilterTests(TestCase):
+    def setUp(self):
+        self.filter = ServiceCallFilter({
+            "light.k1": {"entity_id": "light.k1", "state": "on",
+                         "attributes": {"brightness": 100, "rgb_color": [255, 255, 255]}},
+            "light.k2": {"entity_id": "light.k2", "state": "off", "attributes": {}},
+            "media_player.s": {"entity_id": "media_player.s", "state": "playing",
+                               "attributes": {"volume_level": 0.3}},
+        })
+
+    def test_is_redundant(self):
+        is_redundant = self.filter.is_redundant
+        self.assertTrue(is_redundant("light", "turn_on", "light.k1", {"entity_id": "light.k1", "transition": 0}))
+        data = {"rgb_color": (255, 255, 255), "brightness": 100}
+        self.assertTrue(is_redundant("light", "turn_on", "light.k1", data))
+        self.assertFalse(is_redundant("light", "turn_on", "light.k1", {"brightness": 101}))
+        self.assertFalse(is_redundant("light", "turn_on", "light.k1", {"brightness_step": 10}))
+        self.assertFalse(is_redundant("light", "turn_on", "light.k2", {}))
+        self.assertTrue(is_redundant("light", "turn_off", "light.k2", {}))
+        self.assertFalse(is_redundant("light", "turn_off", "light.k3", {}))
+        self.assertTrue(is_redundant("media_player", "volume_set", "media_player.s", {"volume_level": 0.3}))
+        self.assertFalse(is_redundant("media_player", "media_next_track", "media_player.s", {}))
+
+    def test_redundant_entities(self):
+        action = Action("light", "turn_off", ("light.k1", "light.k2"), None)
+        self.assertEqual(self.filter.redundant_entities(action), ["light.k2"])
+        self.assertEqual(self.filter.redundant_entities(action, skip={"light.k2"}), [])
+        self.assertEqual(self.filter.skipped, {"light.turn_off": 1})
+
+    def test_unconfirmed_call(self):
+        # volume_set 0.35 completed, the mirror still shows 0.3
+        self.filter.applied("media_player", "volume_set", ("media_player.s",),
+                            {"entity_id": "media_player.s", "volume_level": 0.35})
+        action = Action("media_player", "volume_set", ("media_player.s",), None, volume_level=0.3)
+        self.assertFalse(self.filter.is_confirmed("media_player.s"))
+        self.assertEqual(self.filter.redundant_entities(action), [])
+
+        # the mirror shows what was sent
+        self.filter.states["media_player.s"]["attributes"]["volume_level"] = 0.35
+        self.assertTrue(self.filter.is_confirmed("media_player.s"))
+        self.assertNotIn("media_player.s", self.filter.unconfirmed)
+
+    def test_unconfirmed_call_expires(self):
+        self.filter.applied("light", "turn_on", ("light.k1",), {"entity_id": "light.k1", "brightness_step": 10}, now=10)
+        self.assertFalse(self.filter.is_confirmed("light.k1", now=11))
+        self.assertTrue(self.filter.is_confirmed("light.k1", now=10 + self.filter.confirmation_period))
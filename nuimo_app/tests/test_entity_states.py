@@ -0,0 +1,35 @@
+from unittest import TestCase
+
+from senic.nuimo_app.entity_states import EntityStates
+
+
+class EntityStatesTests(TestCase):
+    def test_on_count(self):
+        states = EntityStates(["light.k1", "light.k2"])
+        self.assertEqual(len(states), 0)
+        self.assertIsNone(states.first())
+
+        states.update("light.k2", "on", 100)
+        self.assertTrue(states.all_on())
+        self.assertEqual(states.first(), "light.k2")
+
+        states.update("light.k1", "off", 0)
+        self.assertFalse(states.all_on())
+        states.update("light.k1", "on", 10)
+        states.update("light.k1", "on", 20)
+        self.assertTrue(states.all_on())
+        self.assertEqual((len(states), states.on_count), (2, 2))
+
+        # entities the store isn't for are ignored
+        states.update("light.k3", "off", 0)
+        self.assertTrue(states.all_on())
+
+    def test_values(self):
+        states = EntityStates(["light.k1", "light.k2", "light.k3"])
+        states.update("light.k3", "on", 100)
+        states.update("light.k1", "on", 50)
+        states.set_value("light.k1", 60)
+        self.assertEqual(states.items(), [("light.k1", 60), ("light.k3", 100)])
+        self.assertEqual(states.state("light.k3"), "on")
+        self.assertEqual(states.value("light.k1"), 60)
+        self.assertIsNone(states.state("light.k2"))
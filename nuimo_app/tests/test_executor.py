@@ -0,0 +1,41 @@
+from functools import partial
+from unittest import TestCase
+from unittest.mock import MagicMock, call
+
+from senic.nuimo_app.executor import CallbackExecutor, listener_key
+
+
+class CallbackExecutorTests(TestCase):
+    def test_callbacks_run_in_order(self):
+        executor = CallbackExecutor(num_workers=2)
+        callback = MagicMock()
+        executor.submit(partial(callback, 1), "a")
+        executor.submit(partial(callback, 2), "b")
+        self.assertEqual(executor.queue_depths().count(2), 1)
+
+        executor.start()
+        executor.join()
+        self.assertEqual(callback.call_args_list, [call(1, "a"), call(2, "b")])
+
+    def test_events_are_collapsed(self):
+        executor = CallbackExecutor()
+        callback = MagicMock()
+        executor.submit_event(callback, "light.k1", {"state": "on"})
+        executor.submit_event(callback, "light.k2", {"state": "on"})
+        executor.submit_event(callback, "light.k1", {"state": "off"})
+        self.assertEqual(executor.stats["collapsed"], 1)
+
+        executor.start()
+        executor.join()
+        self.assertEqual(callback.call_args_list, [call({"state": "off"}), call({"state": "on"})])
+
+    def test_failing_callback(self):
+        executor = CallbackExecutor()
+        executor.submit(MagicMock(side_effect=ValueError))
+        executor.start()
+        executor.join()
+        self.assertEqual(executor.stats["failed"], 1)
+
+    def test_listener_key(self):
+        callback = MagicMock()
+        self.assertIs(listener_key(partial(partial(callback, 1), 2)), callback)
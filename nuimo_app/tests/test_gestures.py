@@ -0,0 +1,62 @@
+from threading import Event
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from senic.nuimo_app.gestures import GestureQueue
+
+
+class GestureEvent:
+    def __init__(self, gesture, value=None):
+        self.gesture = gesture
+        self.value = value
+
+
+class GestureQueueTests(TestCase):
+    def test_merge_rotation(self):
+        queue = GestureQueue(MagicMock(), merge_gestures=["rotation"])
+        queue.put(GestureEvent("rotation", 10))
+        queue.put(GestureEvent("rotation", -30))
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(queue.get().value, -20)
+
+        # rotation isn't merged across other gestures
+        queue.put(GestureEvent("rotation", 10))
+        queue.put(GestureEvent("button_press"))
+        queue.put(GestureEvent("rotation", 10))
+        self.assertEqual([x.gesture for x in queue.events], ["rotation", "button_press", "rotation"])
+        self.assertEqual(queue.stats["merged"], 1)
+
+    def test_drop_touch_when_full(self):
+        queue = GestureQueue(MagicMock(), droppable_gestures=["touch"], max_size=2)
+        queue.put(GestureEvent("touch"))
+        queue.put(GestureEvent("swipe_left"))
+        queue.put(GestureEvent("swipe_right"))
+        self.assertEqual([x.gesture for x in queue.events], ["swipe_left", "swipe_right"])
+
+        # nothing left to drop, the new event is dropped
+        queue.put(GestureEvent("button_press"))
+        self.assertEqual([x.gesture for x in queue.events], ["swipe_left", "swipe_right"])
+        self.assertEqual(queue.stats["dropped"], 2)
+
+    def test_worker(self):
+        processed = []
+        done = Event()
+
+        def process(event):
+            processed.append(event.gesture)
+            if event.gesture == "fail":
+                raise ValueError
+            if len(processed) == 3:
+                done.set()
+
+        queue = GestureQueue(process)
+        queue.start()
+        for gesture in ["fail", "swipe_left", "swipe_right"]:
+            queue.put(GestureEvent(gesture))
+
+        self.assertTrue(done.wait(1))
+        self.assertEqual(processed, ["fail", "swipe_left", "swipe_right"])
+
+        queue.stop()
+        queue.worker.join(1)
+        self.assertFalse(queue.worker.is_alive())
@@ -1,7 +1,10 @@
+from concurrent.futures import TimeoutError
 from unittest import TestCase
 from unittest.mock import MagicMock
 
-from senic.nuimo_app.hass import HAListener
+from senic.nuimo_app.errors import HAConnectionError, HARequestError
+from senic.nuimo_app.hass import HAListener, gather
+from senic.nuimo_app.tracing import Trace
 
 
 class TestHAListener(TestCase):
@@ -15,3 +18,290 @@ class TestHAListener(TestCase):
         ]
         self.assertEqual(listener.find_entity_state(states, "eid2"), {"entity_id": "eid2"})
         self.assertEqual(listener.find_entity_state(states, "eid4"), None)
+
+    def test_process_event_dispatches_by_entity(self):
+        listener = HAListener("ws://localhost:8123", MagicMock())
+        callback1 = MagicMock()
+        callback2 = MagicMock()
+        listener.register_state_listener(("eid1", "eid2"), callback1)
+        listener.register_state_listener(("eid2",), callback2)
+
+        payload = {"data": {"entity_id": "eid2"}}
+        listener.process_event(payload)
+        listener.executor.join()
+        callback1.assert_called_once_with(payload)
+        callback2.assert_called_once_with(payload)
+
+        listener.process_event({"data": {"entity_id": "eid3"}})
+        listener.executor.join()
+        self.assertEqual(callback1.call_count, 1)
+
+    def test_unregister_state_listener(self):
+        listener = HAListener("ws://localhost:8123", MagicMock())
+        callback1 = MagicMock()
+        callback2 = MagicMock()
+        listener.register_state_listener(("eid1",), callback1)
+        listener.register_state_listener(("eid1",), callback2)
+
+        listener.unregister_state_listener(("eid1",), callback2)
+        listener.process_event({"data": {"entity_id": "eid1"}})
+        listener.executor.join()
+        self.assertEqual(callback1.call_count, 1)
+        self.assertEqual(callback2.call_count, 0)
+
+        listener.unregister_state_listener(("eid1",))
+        self.assertNotIn("eid1", listener.entity_listeners)
+
+    def test_get_state_from_mirror(self):
+        listener = HAListener("ws://localhost:8123", MagicMock())
+        future = listener.get_state(("eid1", "eid2"))
+        self.assertFalse(future.done())
+
+        listener.load_states()
+        listener.process_result({"id": listener.states_request_id, "type": "result", "success": True, "result": [
+            {"entity_id": "eid1", "state": "on"},
+            {"entity_id": "eid2", "state": "off"},
+            {"entity_id": "eid3", "state": "off"},
+        ]})
+        self.assertEqual(future.result(0), [
+            {"entity_id": "eid1", "state": "on"},
+            {"entity_id": "eid2", "state": "off"},
+        ])
+
+        new_state = {"entity_id": "eid2", "state": "on"}
+        listener.process_event({"data": {"entity_id": "eid2", "new_state": new_state}})
+        self.assertEqual(listener.get_state(("eid2",)).result(0), [new_state])
+
+    def test_supports(self):
+        listener = HAListener("ws://localhost:8123", MagicMock())
+        self.assertFalse(listener.supports("subscribe_entities"))
+        listener.ha_version = "0.40.1"
+        self.assertFalse(listener.supports("subscribe_entities"))
+        listener.ha_version = "2022.3.2"
+        self.assertFalse(listener.supports("subscribe_entities"))
+        listener.ha_version = "2022.4.0b1"
+        self.assertTrue(listener.supports("subscribe_entities"))
+
+    def test_process_entities_event(self):
+        listener = HAListener("ws://localhost:8123", MagicMock())
+        callback = MagicMock()
+        listener.register_state_listener(("light.k1",), callback)
+
+        listener.process_entities_event({"a": {
+            "light.k1": {"s": "on", "a": {"brightness": 10, "friendly_name": "K1"}, "lu": 1.0},
+            "light.k2": {"s": "off", "a": {}, "lu": 1.0},
+        }})
+        listener.executor.join()
+        self.assertTrue(listener.states_loaded)
+        self.assertEqual(listener.states["light.k1"]["state"], "on")
+        self.assertEqual(callback.call_count, 1)
+
+        listener.process_entities_event({"c": {
+            "light.k1": {"+": {"s": "off", "a": {"brightness": 0}}, "-": {"a": ["friendly_name"]}},
+        }})
+        listener.executor.join()
+        new_state = callback.call_args[0][0]["data"]["new_state"]
+        self.assertEqual(new_state["state"], "off")
+        self.assertEqual(new_state["attributes"], {"brightness": 0})
+
+        listener.process_entities_event({"r": ["light.k1"]})
+        listener.executor.join()
+        self.assertNotIn("light.k1", listener.states)
+        self.assertEqual(callback.call_count, 3)
+
+    def test_process_message_skips_unknown_entities(self):
+        listener = HAListener("ws://localhost:8123", MagicMock())
+        listener.event_subscription_id = 2
+        listener.states["light.k2"] = {"entity_id": "light.k2", "state": "off"}
+        callback = MagicMock()
+        listener.register_state_listener(("light.k1",), callback)
+
+        frame = '{"id": 2, "type": "event", "event": {"event_type": "state_changed", "data": {' \
+                '"entity_id": "%s", "old_state": null, "new_state": {"entity_id": "%s", "state": "on"}}}}'
+        listener.process_message(frame % ("light.k2", "light.k2"))
+        listener.executor.join()
+        self.assertEqual(listener.skipped_frames, 1)
+        self.assertNotIn("light.k2", listener.states)
+
+        listener.process_message(frame % ("light.k1", "light.k1"))
+        listener.executor.join()
+        self.assertEqual(callback.call_count, 1)
+        self.assertEqual(listener.states["light.k1"]["state"], "on")
+
+    def test_process_message_keeps_wanted_states_only(self):
+        listener = HAListener("ws://localhost:8123", MagicMock())
+        future = listener.get_state(("eid1",))
+        listener.load_states()
+
+        listener.process_message(
+            '{"id": %d, "type": "result", "success": true, "result": ['
+            '{"entity_id": "eid1", "state": "on"}, {"entity_id": "eid2", "state": "off"}]}' %
+            listener.states_request_id)
+        self.assertEqual(future.result(0), [{"entity_id": "eid1", "state": "on"}])
+        self.assertEqual(listener.states, {"eid1": {"entity_id": "eid1", "state": "on"}})
+        self.assertEqual(len(listener.pending_requests), 0)
+
+    def test_call_service_future(self):
+        listener = HAListener("ws://localhost:8123", MagicMock())
+        future1 = listener.call_service("light", "turn_on", {"entity_id": "light.k1"})
+        future2 = listener.call_service("light", "turn_on", {"entity_id": "light.k2"})
+        request_id1, request_id2 = listener.pending_requests
+
+        listener.process_result({"id": request_id1, "type": "result", "success": True, "result": None})
+        self.assertRaises(TimeoutError, gather, [future1, future2], 0)
+
+        listener.process_result({"id": request_id2, "type": "result", "success": False, "error": {}})
+        self.assertEqual(future1.result(0)["id"], request_id1)
+        self.assertRaises(HARequestError, gather, [future1, future2], 0)
+        self.assertFalse(listener.process_result({"id": request_id2, "type": "result", "success": True}))
+
+    def test_subscribe_to_events_falls_back(self):
+        listener = HAListener("ws://localhost:8123", MagicMock())
+        listener.ha_version = "2022.4.0"
+        subscribed = listener.subscribe_to_events()
+
+        request_id, = listener.pending_requests
+        listener.process_result({"id": request_id, "type": "result", "success": False, "error": {}})
+        self.assertFalse(subscribed.done())
+
+        request_id, = listener.pending_requests
+        listener.process_result({"id": request_id, "type": "result", "success": True, "result": None})
+        self.assertEqual(listener.event_subscription_id, request_id)
+        self.assertFalse(listener.subscribed_to_entities)
+        self.assertTrue(subscribed.done())
+
+    def test_interactive_requests_are_written_first(self):
+        connection = MagicMock()
+        listener = HAListener("ws://localhost:8123", connection)
+        listener.load_states()
+        listener.call_service("light", "turn_on", {"entity_id": "light.k1"})
+        listener.stop()
+
+        listener.write_requests()
+        sent_types = [listener.codec.loads(x[0][0])["type"] for x in connection.send.call_args_list]
+        self.assertEqual(sent_types, ["call_service", "get_states"])
+
+    def test_connection_lost_fails_sent_requests_only(self):
+        listener = HAListener("ws://localhost:8123", MagicMock())
+        sent = listener.call_service("light", "turn_on", {"entity_id": "light.k1"})
+        queued = listener.call_service("light", "turn_on", {"entity_id": "light.k2"})
+        listener.pending_requests.mark_sent(listener.send_queue.get_nowait()[1])
+
+        listener.connection_lost()
+        self.assertIsInstance(sent.exception(0), HAConnectionError)
+        self.assertFalse(queued.done())
+        self.assertFalse(listener.connected.is_set())
+
+    def test_resume_merges_queued_service_calls(self):
+        connection = MagicMock()
+        listener = HAListener("ws://localhost:8123", connection)
+        future1 = listener.call_service("light", "turn_on", {"entity_id": "light.k1", "brightness": 10})
+        future2 = listener.call_service("light", "turn_on", {"entity_id": "light.k2", "brightness": 10})
+        future3 = listener.call_service("light", "turn_on", {"entity_id": "light.k1", "brightness": 20})
+
+        listener.resume()
+        self.assertTrue(listener.connected.is_set())
+        listener.stop()
+        listener.write_requests()
+
+        sent = [listener.codec.loads(x[0][0]) for x in connection.send.call_args_list]
+        self.assertEqual([x["type"] for x in sent], ["call_service", "call_service", "subscribe_events"])
+        self.assertEqual([x["service_data"] for x in sent[:2]], [
+            {"entity_id": "light.k2", "brightness": 10},
+            {"entity_id": "light.k1", "brightness": 20},
+        ])
+
+        listener.process_result({"id": sent[1]["id"], "type": "result", "success": True, "result": None})
+        self.assertEqual(future1.result(0), future3.result(0))
+        self.assertFalse(future2.done())
+
+    def test_resume_keeps_relative_service_calls(self):
+        connection = MagicMock()
+        listener = HAListener("ws://localhost:8123", connection)
+        listener.call_service("light", "turn_on", {"entity_id": "light.k1", "brightness_step": 10})
+        listener.call_service("light", "turn_on", {"entity_id": "light.k1", "brightness_step": 10})
+
+        listener.resume()
+        listener.stop()
+        listener.write_requests()
+
+        sent = [listener.codec.loads(x[0][0]) for x in connection.send.call_args_list]
+        self.assertEqual([x["type"] for x in sent], ["call_service", "call_service", "subscribe_events"])
+
+    def test_resync_notifies_changed_states(self):
+        listener = HAListener("ws://localhost:8123", MagicMock())
+        callback = MagicMock()
+        listener.register_state_listener(("eid1", "eid2"), callback)
+        listener.process_states([
+            {"entity_id": "eid1", "state": "on", "attributes": {}},
+            {"entity_id": "eid2", "state": "on", "attributes": {}},
+        ])
+        listener.executor.join()
+        self.assertFalse(callback.called)
+
+        listener.process_states([
+            {"entity_id": "eid1", "state": "on", "attributes": {}},
+            {"entity_id": "eid2", "state": "off", "attributes": {}},
+        ])
+        listener.executor.join()
+        self.assertEqual(callback.call_count, 1)
+        self.assertEqual(callback.call_args[0][0]["data"]["new_state"]["state"], "off")
+        self.assertEqual(listener.states["eid2"]["state"], "off")
+
+    def test_latencies_by_service(self):
+        listener = HAListener("ws://localhost:8123", MagicMock())
+        listener.call_service("light", "turn_on", {"entity_id": "light.k1"})
+        request_id, = listener.pending_requests
+        listener.pending_requests.mark_sent(request_id)
+
+        listener.process_result({"id": request_id, "type": "result", "success": True, "result": None})
+        self.assertEqual(listener.latencies.get("call_service").count, 1)
+        self.assertEqual(listener.latencies.get("call_service light.turn_on").count, 1)
+
+    def test_call_service_trace(self):
+        connection = MagicMock()
+        listener = HAListener("ws://localhost:8123", connection)
+        trace = Trace("BUTTON_PRESS")
+        listener.call_service("light", "turn_on", {"entity_id": "light.k1"}, trace=trace)
+        listener.stop()
+        listener.write_requests()
+        self.assertEqual(list(trace.durations()), ["request_sent"])
+
+        request_id = listener.codec.loads(connection.send.call_args[0][0])["id"]
+        listener.process_result({"id": request_id, "type": "result", "success": True, "result": None})
+        self.assertEqual(list(trace.durations()), ["request_sent", "result_received"])
+        self.assertFalse(listener.traces)
+
+    def test_run_survives_bad_frames(self):
+        connection = MagicMock()
+        listener = HAListener("ws://localhost:8123", connection)
+        listener.connected.set()
+
+        frames = iter(["{", '{"type": "event", "event": {}}'])
+
+        def recv():
+            frame = next(frames, None)
+            if frame is None:
+                listener.stop()
+            return frame
+
+        connection.recv.side_effect = recv
+        with self.assertLogs("senic.nuimo_app.hass", "ERROR") as logs:
+            listener.run()
+
+        self.assertEqual(connection.recv.call_count, 3)
+        self.assertEqual(len(logs.records), 2)
+
+    def test_heartbeat(self):
+        listener = HAListener("ws://localhost:8123", MagicMock())
+        listener.send_heartbeat()
+        self.assertEqual(len(listener.pending_requests), 0)
+
+        listener.last_ping -= 60
+        listener.send_heartbeat()
+        listener.send_heartbeat()
+        request_id, = listener.pending_requests
+
+        listener.process_message('{"id": %d, "type": "pong"}' % request_id)
+        self.assertFalse(listener.ping_in_flight)
+        self.assertEqual(len(listener.pending_requests), 0)
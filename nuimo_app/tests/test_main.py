@@ -0,0 +1,55 @@
+import configparser
+
+from unittest import TestCase
+
+import nuimo_stub  # noqa: F401, before importing anything that imports nuimo
+
+from senic.nuimo_app.__main__ import read_controllers, read_gesture_overrides, split_list
+
+
+def parse_config(s):
+    config = configparser.ConfigParser()
+    config.read_string(s)
+    return config
+
+
+class ReadConfigTests(TestCase):
+    def test_read_gesture_overrides(self):
+        config = parse_config(
+            "[DEFAULT]\n"
+            "gesture_fly_right = swipe_left\n"
+            "[phue-kitchen]\n"
+            "component = PhilipsHue\n"
+            "gesture_longtouch_top = button_press\n"
+            "gesture_fly_left =\n")
+        self.assertEqual(read_gesture_overrides(config["phue-kitchen"]), {
+            "FLY_RIGHT": "swipe_left",
+            "LONGTOUCH_TOP": "button_press",
+            "FLY_LEFT": "",
+        })
+
+    def test_read_controllers(self):
+        config = parse_config(
+            "[DEFAULT]\n"
+            "controller_mac_address = AA:AA:AA:AA:AA:AA, BB:BB:BB:BB:BB:BB\n"
+            "[phue-kitchen]\n"
+            "component = PhilipsHue\n"
+            "[sonos]\n"
+            "component = Sonos\n"
+            "controllers = BB:BB:BB:BB:BB:BB, CC:CC:CC:CC:CC:CC\n")
+
+        with self.assertLogs("senic.nuimo_app.__main__", "WARNING"):
+            controllers = read_controllers(config["DEFAULT"], config)
+
+        self.assertEqual(controllers, {
+            "AA:AA:AA:AA:AA:AA": ["phue-kitchen"],
+            "BB:BB:BB:BB:BB:BB": ["phue-kitchen", "sonos"],
+        })
+
+    def test_read_controllers_without_controllers(self):
+        config = parse_config("[phue-kitchen]\ncomponent = PhilipsHue\n")
+        self.assertEqual(read_controllers(config["DEFAULT"], config), {})
+
+    def test_split_list(self):
+        self.assertEqual(split_list(" a, b,,c , "), ["a", "b", "c"])
+        self.assertEqual(split_list(""), [])
@@ -0,0 +1,30 @@
+from unittest import TestCase
+
+from senic.nuimo_app.metrics import LatencyHistogram, LatencyHistograms
+
+
+class LatencyHistogramTests(TestCase):
+    def test_percentile(self):
+        histogram = LatencyHistogram(buckets=(0.01, 0.1, 1))
+        self.assertEqual(histogram.percentile(50), None)
+
+        for latency in [0.005, 0.05, 0.06, 0.07, 3]:
+            histogram.observe(latency)
+
+        self.assertEqual(histogram.counts, [1, 3, 0, 1])
+        self.assertEqual(histogram.percentile(20), 0.01)
+        self.assertEqual(histogram.percentile(50), 0.1)
+        self.assertEqual(histogram.percentile(100), 3)
+        self.assertAlmostEqual(histogram.mean(), 0.637)
+
+    def test_percentile_below_bound(self):
+        histogram = LatencyHistogram(buckets=(0.005, 0.01))
+        histogram.observe(0.0001)
+        self.assertEqual(histogram.percentile(50), 0.0001)
+
+    def test_format(self):
+        histograms = LatencyHistograms()
+        histograms.observe("call_service", 0.02)
+        lines = histograms.format().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith("call_service"))
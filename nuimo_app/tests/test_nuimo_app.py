@@ -0,0 +1,271 @@
+from concurrent.futures import Future
+from threading import Event
+from time import monotonic
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+import nuimo_stub  # noqa: F401, before importing anything that imports nuimo
+
+from senic.nuimo_app import errors, icons
+from senic.nuimo_app.components import PhilipsHue, Sonos
+from senic.nuimo_app.hass import HAListener
+from senic.nuimo_app.led import LEDMatrixConfig
+from senic.nuimo_app.nuimo_app import NuimoApp
+
+from nuimo import Gesture, GestureEvent
+
+
+def light_state(entity_id, state, brightness=None):
+    attributes = {"brightness": brightness} if brightness is not None else {}
+    return {"entity_id": entity_id, "state": state, "attributes": attributes}
+
+
+class NuimoAppTestCase(TestCase):
+    def setUp(self):
+        self.ha = HAListener("ws://localhost:8123", MagicMock())
+        self.ha.event_subscription_id = 1
+        self.app = NuimoApp("AA:BB:CC:DD:EE:FF", self.ha, "hci0")
+
+    def tearDown(self):
+        self.app.quit()
+        self.ha.executor.stop()
+
+    def add_component(self, component, states, gesture_overrides=None):
+        self.app.register_component(component, gesture_overrides)
+        self.ha.process_states(states)
+        self.ha.executor.join()
+
+
+class RegisterComponentTests(NuimoAppTestCase):
+    def test_state_changed_before_initial_state_is_applied(self):
+        component = PhilipsHue("Kitchen", ["light.k1"])
+        self.app.register_component(component)
+
+        # keep the executor busy, the initial state isn't applied yet when
+        # the state_changed event arrives
+        busy = Event()
+        self.ha.executor.submit(busy.wait)
+        self.ha.process_states([light_state("light.k1", "off")])
+
+        self.ha.process_message(
+            '{"id": 1, "type": "event", "event": {"event_type": "state_changed", "data": '
+            '{"entity_id": "light.k1", "old_state": null, "new_state": '
+            '{"entity_id": "light.k1", "state": "on", "attributes": {"brightness": 100}}}}}')
+        busy.set()
+        self.ha.executor.join()
+
+        self.assertEqual(self.ha.skipped_frames, 0)
+        self.assertEqual(self.ha.states["light.k1"]["state"], "on")
+        self.assertTrue(component.is_light_on)
+        self.assertEqual(list(self.app.components), [component])
+        self.assertIs(self.app.active_component, component)
+
+
+class UnregisterComponentTests(NuimoAppTestCase):
+    def listeners(self, entity_id):
+        return self.ha.entity_listeners.get(entity_id, [])
+
+    def test_unregister_active_component(self):
+        kitchen = PhilipsHue("Kitchen", ["light.k1"])
+        living_room = PhilipsHue("Living room", ["light.l1"])
+        self.add_component(kitchen, [light_state("light.k1", "on", 100)])
+        self.add_component(living_room, [light_state("light.l1", "on", 100)])
+        self.assertIs(self.app.active_component, kitchen)
+        self.assertIn(self.app.state_changed, self.listeners("light.k1"))
+
+        self.app.unregister_component(kitchen)
+        self.assertIs(self.app.active_component, living_room)
+        self.assertEqual(list(self.app.components), [living_room])
+        self.assertEqual(self.listeners("light.k1"), [])
+        self.assertIn(self.app.state_changed, self.listeners("light.l1"))
+        self.assertIn(living_room.state_changed, self.listeners("light.l1"))
+
+        # unregistering twice doesn't change anything
+        self.app.unregister_component(kitchen)
+        self.assertIs(self.app.active_component, living_room)
+
+    def test_unregister_last_component(self):
+        component = PhilipsHue("Kitchen", ["light.k1"])
+        self.add_component(component, [light_state("light.k1", "on", 100)])
+
+        self.app.unregister_component(component)
+        self.assertIsNone(self.app.active_component)
+        self.assertEqual(self.app.gesture_handlers, {})
+        self.assertEqual(list(self.app.components), [])
+        self.assertEqual(self.listeners("light.k1"), [])
+        self.assertEqual(self.app.controller.displayed[-1], LEDMatrixConfig(icons.ERROR).matrix)
+
+    def test_unregister_component_without_state(self):
+        component = PhilipsHue("Kitchen", ["light.k1"])
+        self.app.register_component(component)
+        self.app.unregister_component(component)
+        self.assertEqual(self.listeners("light.k1"), [])
+
+        # the state arriving later doesn't register it
+        self.ha.process_states([light_state("light.k1", "on", 100)])
+        self.ha.executor.join()
+        self.assertEqual(list(self.app.components), [])
+        self.assertIsNone(self.app.active_component)
+
+
+class DispatchTableTests(NuimoAppTestCase):
+    def test_build_dispatch_table(self):
+        component = PhilipsHue("Kitchen", ["light.k1"])
+        dispatch_table = self.app.build_dispatch_table(component, {"longtouch_top": "button_press", "FLY_LEFT": ""})
+        self.assertEqual(dispatch_table[Gesture.BUTTON_PRESS], component.button_press)
+        self.assertEqual(dispatch_table[Gesture.LONGTOUCH_TOP], component.button_press)
+        self.assertNotIn(Gesture.FLY_LEFT, dispatch_table)
+
+    def test_invalid_overrides(self):
+        component = PhilipsHue("Kitchen", ["light.k1"])
+        for overrides in [{"SHAKE": "button_press"}, {"ROTATION": "swipe_left"}, {"BUTTON_RELEASE": "button_press"}]:
+            with self.assertRaises(ValueError):
+                self.app.build_dispatch_table(component, overrides)
+
+    def test_override_internal_gesture(self):
+        component = PhilipsHue("Kitchen", ["light.k1"])
+        component.swipe_right = MagicMock(return_value=None)
+        self.add_component(component, [light_state("light.k1", "on", 100)], {"TOUCH_LEFT": "swipe_right"})
+        displayed = len(self.app.controller.displayed)
+
+        self.app.process_gesture_event(GestureEvent(Gesture.TOUCH_LEFT))
+        self.assertEqual(component.swipe_right.call_count, 1)
+
+        # other touch gestures still show the active component
+        self.app.process_gesture_event(GestureEvent(Gesture.TOUCH_RIGHT))
+        self.assertEqual(component.swipe_right.call_count, 1)
+        self.assertEqual(len(self.app.controller.displayed), displayed + 1)
+
+
+class ExecuteActionTests(NuimoAppTestCase):
+    def setUp(self):
+        super().setUp()
+        # (service, service data, future) of every service call
+        self.service_calls = []
+        self.ha.call_service = self.call_service
+
+    def call_service(self, domain, service, data, callback=None, timeout=None, trace=None):
+        future = Future()
+        self.service_calls.append((service, data, future))
+        self.ha.add_callback(future, callback)
+        return future
+
+    def complete(self, future, error=None):
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result({})
+        self.ha.executor.join()
+
+    def request_error(self):
+        return errors.HARequestError({"type": "call_service", "id": 1}, "boom")
+
+    def assertDisplayed(self, icon):
+        self.assertEqual(self.app.controller.displayed[-1], LEDMatrixConfig(icon).matrix)
+
+    def test_optimistic_action_rolled_back_on_failure(self):
+        self.add_component(PhilipsHue("Kitchen", ["light.k1"], optimistic=True), [light_state("light.k1", "on", 100)])
+
+        self.app.process_gesture_event(GestureEvent(Gesture.BUTTON_PRESS))
+        self.assertDisplayed(icons.LIGHT_OFF)
+
+        (service, data, future), = self.service_calls
+        self.assertEqual(service, "turn_off")
+        self.complete(future, self.request_error())
+        self.assertDisplayed(icons.ERROR)
+
+    def test_optimistic_action_rolled_back_on_timeout(self):
+        self.add_component(PhilipsHue("Kitchen", ["light.k1"], optimistic=True), [light_state("light.k1", "on", 100)])
+
+        self.app.process_gesture_event(GestureEvent(Gesture.BUTTON_PRESS))
+        self.assertDisplayed(icons.LIGHT_OFF)
+
+        self.app.fail_expired_actions(monotonic() + self.app.actions.timeout + 1)
+        self.assertDisplayed(icons.ERROR)
+
+        # a late result doesn't show anything
+        displayed = len(self.app.controller.displayed)
+        self.complete(self.service_calls[0][2])
+        self.assertEqual(len(self.app.controller.displayed), displayed)
+
+    def test_optimistic_action_succeeds(self):
+        self.add_component(PhilipsHue("Kitchen", ["light.k1"], optimistic=True), [light_state("light.k1", "on", 100)])
+
+        self.app.process_gesture_event(GestureEvent(Gesture.BUTTON_PRESS))
+        displayed = len(self.app.controller.displayed)
+
+        self.complete(self.service_calls[0][2])
+        self.assertEqual(len(self.app.controller.displayed), displayed)
+        self.assertDisplayed(icons.LIGHT_OFF)
+
+    def test_superseded_result_leaves_led_alone(self):
+        self.add_component(PhilipsHue("Kitchen", ["light.k1"]), [light_state("light.k1", "on", 100)])
+
+        self.app.process_gesture_event(GestureEvent(Gesture.BUTTON_PRESS))
+        self.app.process_gesture_event(GestureEvent(Gesture.BUTTON_PRESS))
+        (_, _, first), (_, _, second) = self.service_calls
+
+        self.complete(second)
+        self.assertDisplayed(icons.LIGHT_OFF)
+        displayed = len(self.app.controller.displayed)
+
+        # neither the failure nor the timeout of the older action shows
+        self.complete(first, self.request_error())
+        self.app.fail_expired_actions(monotonic() + self.app.actions.timeout + 1)
+        self.assertEqual(len(self.app.controller.displayed), displayed)
+
+    def test_failed_batched_call_is_retried_by_entity(self):
+        self.add_component(PhilipsHue("Kitchen", ["light.k1", "light.k2"]),
+                           [light_state("light.k1", "on", 100), light_state("light.k2", "on", 100)])
+
+        self.app.process_gesture_event(GestureEvent(Gesture.BUTTON_PRESS))
+        (_, data, batched), = self.service_calls
+        self.assertEqual(data["entity_id"], ["light.k1", "light.k2"])
+
+        self.complete(batched, self.request_error())
+        self.assertEqual([x[1]["entity_id"] for x in self.service_calls[1:]], ["light.k1", "light.k2"])
+
+        self.complete(self.service_calls[1][2])
+        self.complete(self.service_calls[2][2], self.request_error())
+        self.assertDisplayed(icons.ERROR)
+
+    def test_failed_non_idempotent_batched_call_is_not_retried(self):
+        self.add_component(Sonos("Living room", ["media_player.s1", "media_player.s2"]),
+                           [{"entity_id": x, "state": "playing", "attributes": {}}
+                            for x in ["media_player.s1", "media_player.s2"]])
+
+        self.app.process_gesture_event(GestureEvent(Gesture.SWIPE_RIGHT))
+        (service, _, batched), = self.service_calls
+        self.assertEqual(service, "media_next_track")
+
+        # the track might already be skipped on some speakers
+        self.complete(batched, self.request_error())
+        self.assertEqual(len(self.service_calls), 1)
+        self.assertDisplayed(icons.ERROR)
+
+    def test_batched_call_without_answer_is_not_retried(self):
+        self.add_component(PhilipsHue("Kitchen", ["light.k1", "light.k2"]),
+                           [light_state("light.k1", "on", 100), light_state("light.k2", "on", 100)])
+
+        self.app.process_gesture_event(GestureEvent(Gesture.BUTTON_PRESS))
+        self.complete(self.service_calls[0][2], errors.HAConnectionError({"type": "call_service", "id": 1}, "closed"))
+
+        self.assertEqual(len(self.service_calls), 1)
+        self.assertDisplayed(icons.ERROR)
+
+    def test_reverted_rotation_before_state_changed(self):
+        component = Sonos("Living room", ["media_player.s"])
+        self.add_component(component, [{"entity_id": "media_player.s", "state": "playing",
+                                        "attributes": {"volume_level": 0.2}}])
+        step = component.ROTATION_RANGE / len(component.volume_scale)
+
+        self.app.rotate(step, 0)
+        (_, data, future), = self.service_calls
+        self.assertGreater(data["volume_level"], 0.2)
+        self.complete(future)
+
+        # HA's state_changed event didn't arrive yet, the mirror still
+        # shows 0.2
+        self.app.rotate(-step, 0)
+        self.assertEqual(len(self.service_calls), 2)
+        self.assertEqual(self.service_calls[1][1]["volume_level"], 0.2)
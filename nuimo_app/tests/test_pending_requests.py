@@ -0,0 +1,44 @@
+from concurrent.futures import Future
+from unittest import TestCase
+
+from senic.nuimo_app.errors import HARequestError, HARequestTimeoutError
+from senic.nuimo_app.pending_requests import PendingRequests
+
+
+class PendingRequestsTests(TestCase):
+    def test_pop(self):
+        pending = PendingRequests()
+        request, future = {"id": 1, "type": "get_states"}, Future()
+        self.assertTrue(pending.add(request, future))
+        self.assertIn(1, pending)
+
+        self.assertEqual(pending.pop(1), (request, future))
+        self.assertEqual(pending.pop(1), (None, None))
+        self.assertEqual(pending.stats["unknown"], 1)
+
+    def test_max_size(self):
+        pending = PendingRequests(max_size=1)
+        self.assertTrue(pending.add({"id": 1, "type": "get_states"}, Future()))
+
+        future = Future()
+        self.assertFalse(pending.add({"id": 2, "type": "get_states"}, future))
+        self.assertIsInstance(future.exception(0), HARequestError)
+        self.assertEqual(len(pending), 1)
+        self.assertEqual(pending.stats["rejected"], 1)
+
+    def test_expire(self):
+        pending = PendingRequests(timeout=10)
+        future1, future2, future3 = Future(), Future(), Future()
+        pending.add({"id": 1, "type": "call_service"}, future1)
+        pending.add({"id": 2, "type": "call_service"}, future2, timeout=1)
+        pending.add({"id": 3, "type": "call_service"}, future3, timeout=1)
+        pending.pop(3)
+
+        self.assertEqual(pending.expire(), [])
+
+        expired = pending.expire(now=pending.deadlines[0][0] + 5)
+        self.assertEqual(expired, [({"id": 2, "type": "call_service"}, future2)])
+        self.assertIsInstance(future2.exception(0), HARequestTimeoutError)
+        self.assertFalse(future1.done())
+        self.assertEqual(list(pending), [1])
+        self.assertEqual(pending.stats["timed_out"], 1)
@@ -0,0 +1,32 @@
+from unittest import TestCase
+
+from senic.nuimo_app.quantize import PerceptualScale
+
+
+class PerceptualScaleTests(TestCase):
+    def test_levels(self):
+        scale = PerceptualScale(255, steps=4, gamma=2)
+        self.assertEqual(scale.levels, [0, 16, 64, 143, 255])
+        self.assertEqual(len(scale), 4)
+
+        # levels rounding to the same value are merged
+        scale = PerceptualScale(1, steps=100, gamma=2, digits=2)
+        self.assertEqual(len(scale.levels), len(set(scale.levels)))
+        self.assertLess(len(scale), 100)
+        self.assertEqual(scale.levels[:2], [0, 0.01])
+
+    def test_step(self):
+        scale = PerceptualScale(255, steps=4, gamma=2)
+        self.assertEqual(scale.step(16, 1), 64)
+        self.assertEqual(scale.step(16, -3), 0)
+        self.assertEqual(scale.step(143, 5), 255)
+        # values between levels start from the closest level
+        self.assertEqual(scale.step(30, 1), 64)
+        self.assertEqual(scale.step(50, 1), 143)
+        self.assertEqual(scale.step(300, -1), 143)
+
+    def test_step_index(self):
+        scale = PerceptualScale(255, steps=4, gamma=2)
+        self.assertEqual(scale.step_index(16, 1), 2)
+        self.assertEqual(scale.step_index(254, 1), 4)
+        self.assertEqual(scale.step_index(0, -1), 0)
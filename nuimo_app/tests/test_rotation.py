@@ -0,0 +1,78 @@
+from threading import Event
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from senic.nuimo_app.rotation import ACCELERATION_THRESHOLD, MAX_ACCELERATION, RotationAggregator, accelerate
+
+
+class RotationAggregatorTests(TestCase):
+    def test_flush_on_tick(self):
+        flush = MagicMock(return_value=False)
+        aggregator = RotationAggregator(flush)
+        aggregator.tick()
+        self.assertFalse(flush.called)
+
+        aggregator.add(10)
+        aggregator.add(20)
+        aggregator.tick()
+        self.assertEqual(flush.call_args[0][0], 30)
+        self.assertGreater(flush.call_args[0][1], 0)
+
+    def test_flush_leftover_when_action_completed(self):
+        flush = MagicMock(return_value=True)
+        aggregator = RotationAggregator(flush)
+        aggregator.add(10)
+        aggregator.tick()
+        self.assertTrue(aggregator.action_in_progress)
+
+        aggregator.add(20)
+        aggregator.tick()
+        self.assertEqual(flush.call_count, 1)
+
+        flush.return_value = False
+        aggregator.action_completed()
+        self.assertEqual(flush.call_args[0][0], 20)
+        self.assertFalse(aggregator.action_in_progress)
+
+    def test_action_completed_during_flush(self):
+        aggregator = RotationAggregator(None)
+
+        def flush(value, velocity):
+            aggregator.action_completed()
+            return True
+
+        aggregator.flush_callback = flush
+        aggregator.add(10)
+        aggregator.tick()
+        self.assertFalse(aggregator.action_in_progress)
+
+    def test_flush_failed(self):
+        flushed = Event()
+        flush = MagicMock(side_effect=KeyError)
+        aggregator = RotationAggregator(flush, tick_interval=0.01)
+
+        aggregator.add(10)
+        with self.assertLogs("senic.nuimo_app.rotation", "ERROR"):
+            aggregator.tick()
+        self.assertFalse(aggregator.action_in_progress)
+
+        # the thread survives failing flushes
+        aggregator.start()
+        self.addCleanup(aggregator.stop)
+        with self.assertLogs("senic.nuimo_app.rotation", "ERROR"):
+            aggregator.add(20)
+            aggregator.thread.join(0.1)
+
+        flush.side_effect = lambda value, velocity: flushed.set()
+        aggregator.add(30)
+        self.assertTrue(flushed.wait(1))
+        self.assertTrue(aggregator.thread.is_alive())
+
+
+class AccelerateTests(TestCase):
+    def test_accelerate(self):
+        self.assertEqual(accelerate(100, 0), 100)
+        self.assertEqual(accelerate(-100, -ACCELERATION_THRESHOLD), -100)
+        self.assertEqual(accelerate(100, 2 * ACCELERATION_THRESHOLD), 200)
+        self.assertEqual(accelerate(-100, -2 * ACCELERATION_THRESHOLD), -200)
+        self.assertEqual(accelerate(100, 100 * ACCELERATION_THRESHOLD), 100 * MAX_ACCELERATION)
@@ -0,0 +1,28 @@
+from unittest import TestCase
+
+from senic.nuimo_app.tracing import Trace, Tracer
+
+
+class TracerTests(TestCase):
+    def test_histograms(self):
+        tracer = Tracer(max_traces=2)
+        for start in [0, -1, -2]:
+            trace = Trace("ROTATION", start=start)
+            trace.component = "Kitchen"
+            trace.mark("action_created")
+            tracer.finish(trace)
+
+        histograms = tracer.histograms()
+        histogram = histograms.get("ROTATION Kitchen action_created")
+        # only the last two traces are kept
+        self.assertEqual(histogram.count, 2)
+        self.assertGreater(histogram.max, 2)
+        self.assertIn("ROTATION Kitchen action_created", tracer.format())
+
+    def test_mark_keeps_latest(self):
+        trace = Trace("BUTTON_PRESS", start=0)
+        trace.mark("result_received")
+        first = trace.durations()["result_received"]
+        trace.mark("result_received")
+        self.assertGreaterEqual(trace.durations()["result_received"], first)
+        self.assertEqual(list(trace.durations()), ["result_received"])